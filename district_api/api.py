@@ -5,12 +5,25 @@
 .. moduleauthor:: Noemi Millman <noemi@triopter.com>
 """
 
-import requests
 from collections import defaultdict
 
+from district_api.lazy import lazy_import
 from district_api.exceptions import DistrictApiError, ApiUnavailable, \
     LocationUnavailable, AuthorizationError, QuotaExceeded, BadRequest, \
-    InvalidResponse
+    InvalidResponse, NotModified, excerpt
+from district_api.keys import KeyPool
+from district_api.hedging import HedgePolicy
+from district_api.geometry import read_kml
+from district_api.spatial import spatial_join
+from district_api.catalog import DistrictCatalog
+from district_api.profiling import Profiler, NULL_PROFILER
+
+# requests takes longer to import than the rest of the package put together,
+# so it's only loaded once we actually send a request
+requests = lazy_import('requests')
+
+# Compressed responses are a fraction of the size of the all-districts JSON
+ACCEPT_ENCODING = 'gzip, deflate'
 
 class District(object):
     """
@@ -53,6 +66,13 @@ class District(object):
         except AttributeError:
             return False
         
+    def __ne__(self, other):
+        return not self == other
+        
+    def __hash__(self):
+        # Consistent with __eq__, so that districts can key dicts
+        return hash((self.district, self.level, self.kml_url))
+        
     def __lt__(self, other):
         # comparisons are different for numeric vs. non-numeric district names
         try:
@@ -76,21 +96,60 @@ class DistrictApi(object):
 
     :ivar string api_key: NY Times Districts API key. Obtained from 
        `NY Times Developer Network <http://developer.nytimes.com/apps/register/>`_
+    :ivar KeyPool key_pool: Pool of API keys among which requests are spread.
+       Contains just ``api_key`` unless several keys were given.
     :ivar string url: Endpoint for NY Times Districts API.  Defaults to URL
         specified in `the docs <http://developer.nytimes.com/docs/districts_api>`_
+    :ivar HedgePolicy hedge_policy: Policy for hedging single-location 
+        requests, or None if hedging is disabled
+    :ivar bool keep_responses: Whether errors keep a reference to the 
+        response that caused them (see ``exceptions.DistrictApiError``)
+    :ivar profiler: ``profiling.Profiler`` recording the time spent in each
+        phase of each call, or ``profiling.NULL_PROFILER`` if profiling is 
+        off.  See ``enable_profiling``.
     """
     def __init__(self, api_key, *args, **kwargs):
         """
-        :param string api_key: NY Times Districts API key. Obtained from 
+        :param api_key: NY Times Districts API key. Obtained from 
            `NY Times Developer Network <http://developer.nytimes.com/apps/register/>`_
+           May also be a list of keys or a ``KeyPool``, in which case each 
+           request uses the least loaded key in the pool.
+        :type api_key: string, list or KeyPool
         :param string url: Override API endpoint (used mostly for testing)
+        :param hedge_policy: *(optional)* Send a duplicate request when a 
+           single-location request is slow, as determined by this policy.  
+           Pass ``True`` to use the default ``HedgePolicy``.
+        :type hedge_policy: HedgePolicy or bool
+        :param bool keep_responses: *(optional)* Attach the full response to 
+           errors raised for it, as ``response``.  Off by default, so that 
+           errors collected in bulk don't hold on to response bodies.
         """
         self.api_key = api_key
+        
+        if isinstance(api_key, KeyPool):
+            self.key_pool = api_key
+        elif isinstance(api_key, (list, tuple)):
+            self.key_pool = KeyPool(api_key)
+        else:
+            self.key_pool = KeyPool([api_key])
+            
         self.url = kwargs.pop('url', 'http://api.nytimes.com/svc/politics/v2/districts.json')
         
+        self.hedge_policy = kwargs.pop('hedge_policy', None)
+        if self.hedge_policy is True:
+            self.hedge_policy = HedgePolicy()
+            
+        self.keep_responses = kwargs.pop('keep_responses', False)
+            
+        self.profiler = NULL_PROFILER
+        
+        # Validators and constructed results of earlier all-districts 
+        # queries, indexed by query_key
+        self._conditional = {}
+        
         super(DistrictApi, self).__init__(*args, **kwargs)
 
-    def construct_query_vars(self, lat_lng=None):
+    def construct_query_vars(self, lat_lng=None, api_key=None):
         """
         Constructs the query string for our particular API query.  Called by 
         ``send_request``.  This doesn't really need to be a separate method,
@@ -102,13 +161,18 @@ class DistrictApi(object):
            be returned.
            
         :type lat_lng: tuple of floats
+        :param string api_key: *(optional)* API key to use.  Defaults to the
+           least loaded key in ``key_pool``.
         :returns: Dictionary of variables that should be included in the query 
            string when querying the API
            
         :rtype: dict
         """
+        if api_key is None:
+            api_key = self.key_pool.select()
+            
         query_vars = {
-            'api-key': self.api_key,
+            'api-key': api_key,
         }
         
         if lat_lng:
@@ -117,7 +181,21 @@ class DistrictApi(object):
         
         return query_vars
         
-    def send_request(self, lat_lng=None):
+    def query_key(self, lat_lng=None):
+        """
+        :param lat_lng: *(optional)* 2-tuple of latitude and longitude floats
+        :type lat_lng: tuple of floats
+        :returns: Key identifying a query regardless of the API key it's sent
+            with, under which its ETag and Last-Modified validators are 
+            remembered
+        :rtype: tuple
+        """
+        query_vars = self.construct_query_vars(lat_lng, '')
+        del query_vars['api-key']
+        
+        return (self.url,) + tuple(sorted(query_vars.iteritems()))
+        
+    def send_request(self, lat_lng=None, api_key=None, validators=None):
         """
         Construct query string; send HTTP request to API; return HTTP response.
         
@@ -127,11 +205,34 @@ class DistrictApi(object):
            be returned.
            
         :type lat_lng: tuple of floats
+        :param string api_key: *(optional)* API key to use.  Defaults to the
+           least loaded key in ``key_pool``.
+        :param dict validators: *(optional)* ``etag`` and/or 
+           ``last_modified`` of an earlier response to the same query.  If 
+           given, the request is made conditional on the data having changed
+           since.
         :returns: raw HTTP response from API
         :rtype: requests.Response
         """
-        query_vars = self.construct_query_vars(lat_lng)
-        return requests.get(self.url, params=query_vars)
+        query_vars = self.construct_query_vars(lat_lng, api_key)
+        self.profiler.annotate(query_vars)
+        
+        headers = {'Accept-Encoding': ACCEPT_ENCODING}
+        if validators:
+            if validators.get('etag'):
+                headers['If-None-Match'] = validators['etag']
+            if validators.get('last_modified'):
+                headers['If-Modified-Since'] = validators['last_modified']
+        
+        if lat_lng and self.hedge_policy:
+            # A hedge is a second request with the same key, so it counts 
+            # against that key's quota too
+            api_key = query_vars['api-key']
+            return self.hedge_policy.run(requests.get, (self.url,), 
+                {'params': query_vars, 'headers': headers}, 
+                on_hedge=lambda: self.key_pool.record(api_key))
+            
+        return requests.get(self.url, params=query_vars, headers=headers)
         
     def validate_response(self, response):
         """
@@ -139,22 +240,32 @@ class DistrictApi(object):
         exceptions.
         
         :param requests.Response response: Response object returned by Times API
-        :raises: ApiUnavailable, AuthorizationError, BadRequest, DistrictApiError 
+        :raises: ApiUnavailable, AuthorizationError, QuotaExceeded, BadRequest, 
+            NotModified, DistrictApiError 
         """
         if response.status_code == 200:
             return
+            
+        keep = self.keep_responses
+            
+        if response.status_code == 304:
+            raise NotModified.from_response(response, keep_response=keep)
         
         if response.status_code == 400:
-            raise BadRequest(response)
+            raise BadRequest.from_response(response, keep_response=keep)
             
         if response.status_code in (404, 500):
-            raise ApiUnavailable(response)
+            raise ApiUnavailable.from_response(response, keep_response=keep)
             
         if response.status_code == 403:
-            raise AuthorizationError(response)
+            raise AuthorizationError.from_response(response, 
+                keep_response=keep)
+            
+        if response.status_code == 429:
+            raise QuotaExceeded.from_response(response, keep_response=keep)
             
         # Unknown error status
-        raise DistrictApiError(response)
+        raise DistrictApiError.from_response(response, keep_response=keep)
         
     def parse_response(self, response):
         """
@@ -170,7 +281,9 @@ class DistrictApi(object):
         try:
             return response.json()
         except ValueError:
-            raise InvalidResponse(response.text)
+            raise InvalidResponse.from_response(response, 
+                'Response body is not valid JSON', 
+                keep_response=self.keep_responses)
     
     def validate_response_body(self, response_dict):
         """
@@ -185,13 +298,15 @@ class DistrictApi(object):
         status = response_dict.get('status')
         
         if not status:
-            raise InvalidResponse(response_dict)
+            raise InvalidResponse('Response has no status', 
+                excerpt=excerpt(response_dict))
 
         if status != 'OK':
             errs = response_dict.get('errors')
-            raise LocationUnavailable(errs)
+            raise LocationUnavailable('Response status is %s' % status, 
+                errors=errs)
             
-    def get_data(self, lat_lng=None):
+    def get_data(self, lat_lng=None, validators=None):
         """
         Construct query string; send HTTP request to API; return HTTP response.
         
@@ -201,24 +316,67 @@ class DistrictApi(object):
             available districts will be returned.
            
         :type lat_lng: tuple of floats or None
+        :param dict validators: *(optional)* ``etag`` and ``last_modified`` 
+            of an earlier response, to make the request conditional.  Updated
+            in place with those of the new response.
         :raises: TypeError, ValueError, ApiUnavailable, AuthorizationError, 
-            BadRequest, LocationUnavailable, InvalidResponse, DistrictApiError
+            QuotaExceeded, BadRequest, LocationUnavailable, InvalidResponse, 
+            NotModified, DistrictApiError
             
         :returns: Dictionary of raw data parsed from JSON API response
         :rtype: dict
         """
-        response = self.send_request(lat_lng)
+        profiler = self.profiler
         
-        # validate response status code
-        self.validate_response(response)
-        
-        # Parse response into dict
-        data = self.parse_response(response)
-        
-        # Validate response
-        self.validate_response_body(data)
-
-        return data
+        try:
+            with profiler.span('get_data'):
+                while True:
+                    api_key = self.key_pool.acquire()
+                    with profiler.span('send_request'):
+                        response = self.send_request(lat_lng, api_key, 
+                            validators)
+                
+                    # validate response status code
+                    try:
+                        with profiler.span('validate_response'):
+                            self.validate_response(response)
+                    except (AuthorizationError, QuotaExceeded) as e:
+                        # With a single key there's nothing to fall back to, 
+                        # so leave it in rotation and let the caller decide 
+                        # what to do
+                        if len(self.key_pool) == 1:
+                            raise
+                        
+                        # Sideline the rejected key and retry with another 
+                        # one.  A refused key is out for good; one that's 
+                        # over quota only until its quota frees up.
+                        self.key_pool.sideline(api_key, permanent=isinstance(
+                            e, AuthorizationError))
+                        if not self.key_pool.available_count():
+                            raise
+                        continue
+                    
+                    break
+            
+                # Parse response into dict
+                with profiler.span('parse_response'):
+                    data = self.parse_response(response)
+            
+                # Validate response
+                with profiler.span('validate_response_body'):
+                    self.validate_response_body(data)
+                
+                if validators is not None:
+                    validators['etag'] = response.headers.get('ETag')
+                    validators['last_modified'] = response.headers.get(
+                        'Last-Modified')
+    
+                return data
+        except DistrictApiError as e:
+            # Record which location failed, for callers collecting errors
+            if e.lat_lng is None:
+                e.lat_lng = lat_lng
+            raise
         
     def construct_all_locations_data(self, data):
         """
@@ -240,7 +398,8 @@ class DistrictApi(object):
         try:
             results = data['results']
         except KeyError:
-            raise InvalidResponse(data)
+            raise InvalidResponse('Response has no results', 
+                excerpt=excerpt(data))
         
         # Populate our dict
         try:
@@ -250,12 +409,13 @@ class DistrictApi(object):
                 raw_districts[result['level']].append(district)
                 
         except (KeyError, TypeError):
-            raise InvalidResponse(result)
+            raise InvalidResponse('Malformed result', excerpt=excerpt(result))
         
         # Now let's sort each of our lists, and in the process convert back to
         # a regular dict
-        for k, v in raw_districts.iteritems():
-            districts[k] = sorted(v)
+        with self.profiler.span('sort'):
+            for k, v in raw_districts.iteritems():
+                districts[k] = sorted(v)
             
         return districts
         
@@ -271,10 +431,66 @@ class DistrictApi(object):
             
         :rtype: dict
         """
-        data = self.get_data()
-        
+        with self.profiler.span('get_all_districts'):
+            entry = self._get_all_districts()
+            
+        # Copy the lists, so that callers can't alter the ones we keep
+        return dict((level, list(districts)) for level, districts in 
+            entry['districts'].iteritems())
+        
+    def _get_all_districts(self):
+        # The all-districts query is made conditional on the data having 
+        # changed since it was last retrieved.  If it hasn't, the districts 
+        # (and catalog) constructed then are reused without re-parsing or 
+        # re-sorting anything.
+        key = self.query_key()
+        previous = self._conditional.get(key)
+        validators = {}
+        if previous is not None:
+            validators['etag'] = previous['etag']
+            validators['last_modified'] = previous['last_modified']
+            
+        try:
+            data = self.get_data(validators=validators)
+        except NotModified:
+            if previous is None:
+                raise
+            return previous
+            
         # Convert returned data into Python objects
-        return self.construct_all_locations_data(data)
+        with self.profiler.span('construct_all_locations_data'):
+            districts = self.construct_all_locations_data(data)
+            
+        entry = dict(validators, districts=districts, catalog=None)
+        if validators['etag'] or validators['last_modified']:
+            self._conditional[key] = entry
+        else:
+            # Nothing to make the next request conditional on; forget the 
+            # old validators, or a 304 to them would bring back stale data
+            self._conditional.pop(key, None)
+            
+        return entry
+        
+    def get_district_catalog(self):
+        """
+        Get information about all districts about which the API can provide 
+        data, indexed for fast lookups.
+        
+        :raises: ApiUnavailable, AuthorizationError, QuotaExceeded, BadRequest, 
+            LocationUnavailable, InvalidResponse, DistrictApiError
+            
+        :rtype: catalog.DistrictCatalog
+        """
+        with self.profiler.span('get_district_catalog'):
+            entry = self._get_all_districts()
+            
+            # Catalogs aren't modified after they're built, so one built from 
+            # unchanged data can be handed out again
+            if entry['catalog'] is None:
+                with self.profiler.span('construct_catalog'):
+                    entry['catalog'] = DistrictCatalog(entry['districts'])
+                    
+        return entry['catalog']
         
     def construct_single_location_data(self, data):
         """
@@ -291,7 +507,8 @@ class DistrictApi(object):
         try:
             results = data['results']
         except KeyError:
-            raise InvalidResponse(data)
+            raise InvalidResponse('Response has no results', 
+                excerpt=excerpt(data))
         
         try:
             for result in results:
@@ -300,7 +517,7 @@ class DistrictApi(object):
                 districts[result['level']] = district
                 
         except (KeyError, TypeError):
-            raise InvalidResponse(result)
+            raise InvalidResponse('Malformed result', excerpt=excerpt(result))
             
         return districts
         
@@ -328,9 +545,161 @@ class DistrictApi(object):
         lat = float(lat_lng[0])
         lng = float(lat_lng[1])
         
-        data = self.get_data((lat, lng,))
+        with self.profiler.span('get_districts'):
+            data = self.get_data((lat, lng,))
+            
+            # Convert returned data into Python objects
+            with self.profiler.span('construct_single_location_data'):
+                return self.construct_single_location_data(data)
         
-        # Convert returned data into Python objects
-        return self.construct_single_location_data(data)
+    def enable_profiling(self, profiler=None, **kwargs):
+        """
+        Start recording how long each phase of each call takes: sending the
+        request, validating the response, parsing the JSON, building District
+        objects and sorting them.  Can be turned on and off at any time.
+        
+        :param profiling.Profiler profiler: *(optional)* Profiler to record
+            to.  Defaults to a new one, created with any other keyword 
+            arguments given.
+        :returns: The profiler.  Use its ``slowest`` method to see the slowest
+            calls and their query vars (with the API key redacted), and its
+            ``dump`` method to write a profile for flame graph tools.
+        :rtype: profiling.Profiler
+        """
+        if profiler is None:
+            profiler = Profiler(**kwargs)
+            
+        self.profiler = profiler
+        return profiler
+        
+    def disable_profiling(self):
+        """
+        Stop recording timings.
+        
+        :returns: The profiler that was in use, or None
+        :rtype: profiling.Profiler or None
+        """
+        profiler = self.profiler
+        self.profiler = NULL_PROFILER
+        
+        return profiler if profiler is not NULL_PROFILER else None
+        
+    def get_boundary(self, district, tolerance=None):
+        """
+        Download and parse the KML file describing a district's boundaries.
+        The file is parsed as it streams in, so it's never held in memory in 
+        full.
+        
+        :param District district: District whose boundary should be retrieved
+        :param float tolerance: *(optional)* Simplify the boundary, allowing it
+            to move by at most this many degrees.  See 
+            ``geometry.simplify_ring``.
+        :raises: ValueError, ApiUnavailable, BadRequest, DistrictApiError, 
+            InvalidResponse
+        :returns: The district's boundary, or None if the district has no 
+            ``kml_url``
+        :rtype: geometry.MultiPolygon or None
+        """
+        if not district.kml_url:
+            return None
+            
+        response = requests.get(district.kml_url, stream=True)
+        self.validate_response(response)
+        
+        # have urllib3 undo any gzip/deflate transfer encoding for us
+        response.raw.decode_content = True
+        
+        try:
+            return read_kml(response.raw, tolerance)
+        except (ValueError, SyntaxError):
+            raise InvalidResponse('Malformed KML at %s' % district.kml_url)
+        finally:
+            response.close()
+            
+    def get_boundaries(self, levels=None, tolerance=None):
+        """
+        Get the boundaries of all districts about which the API can provide 
+        data.
+        
+        :param list levels: *(optional)* Only retrieve boundaries for these
+            electoral levels
+        :param float tolerance: *(optional)* Simplify boundaries with this 
+            tolerance, in degrees.  See ``get_boundary``.
+        :raises: ApiUnavailable, AuthorizationError, QuotaExceeded, BadRequest, 
+            LocationUnavailable, InvalidResponse, DistrictApiError
+            
+        :returns: Dictionary indexed by electoral level, with each item 
+            containing a list of ``(District, geometry.MultiPolygon)`` pairs.
+            Districts without a ``kml_url`` are left out.
+            
+        :rtype: dict
+        """
+        boundaries = {}
+        
+        for level, districts in self.get_all_districts().iteritems():
+            if levels is not None and level not in levels:
+                continue
+                
+            boundaries[level] = []
+            for district in districts:
+                boundary = self.get_boundary(district, tolerance)
+                if boundary is not None:
+                    boundaries[level].append((district, boundary))
+                    
+        return boundaries
+        
+    def spatial_join(self, points, levels=None, groups=False, processes=1):
+        """
+        Count (or group) a set of points by the districts they fall in.  
+        Boundaries are retrieved from the API; see ``spatial.spatial_join`` 
+        to join against boundaries you already have.
+        
+        :param points: Sequence of (latitude, longitude) pairs
+        :param list levels: *(optional)* Electoral levels to join against.
+            Defaults to all levels.
+        :param bool groups: *(optional)* If True, return the indices of the 
+            points in each district instead of just counting them
+        :param int processes: *(optional)* Number of worker processes.  Pass
+            None to use every core.  Defaults to 1.
+        :raises: ApiUnavailable, AuthorizationError, QuotaExceeded, BadRequest, 
+            LocationUnavailable, InvalidResponse, DistrictApiError
+            
+        :returns: Dictionary indexed by electoral level, with each item a dict
+            mapping each District to a count of points (or array of point 
+            indices)
+            
+        :rtype: dict
+        """
+        boundaries = self.get_boundaries(levels)
+        return spatial_join(points, boundaries, levels=levels, groups=groups, 
+            processes=processes)
+        
+    def annotate_frame(self, df, lat='lat', lng='lng', levels=None, 
+        resolver=None, catalog=None):
+        """
+        Add district columns to a pandas DataFrame.  Requires pandas.  See 
+        ``frames.annotate_frame`` for details, and ``frames.annotate_batches``
+        for frames too large to fit in memory.
+        
+        :param pandas.DataFrame df: Frame to annotate.  It isn't modified.
+        :param string lat: *(optional)* Name of the latitude column
+        :param string lng: *(optional)* Name of the longitude column
+        :param list levels: *(optional)* Levels for which to add columns.
+            Defaults to every level in ``catalog``, or if there is none, 
+            every level found.
+        :param resolver: *(optional)* Local index (e.g. 
+            ``shared.SharedIndex``) or boundaries dict to resolve locations 
+            with.  By default each distinct location is looked up through 
+            the API.
+        :param catalog: *(optional)* Catalog whose districts are used as 
+            column categories
+        :raises: ApiUnavailable, AuthorizationError, QuotaExceeded, BadRequest, 
+            InvalidResponse, DistrictApiError
+        :returns: Copy of ``df`` with "<level> district" and 
+            "<level> kml_url" columns added
+        :rtype: pandas.DataFrame
+        """
+        from district_api.frames import annotate_frame
         
-        
\ No newline at end of file
+        return annotate_frame(df, resolver or self, lat=lat, lng=lng, 
+            levels=levels, catalog=catalog)
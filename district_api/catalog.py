@@ -0,0 +1,341 @@
+"""
+.. module:: catalog
+   :synopsis: Indexed catalog of all districts, for fast lookups.
+
+.. moduleauthor:: Noemi Millman <noemi@triopter.com>
+"""
+
+import re
+from bisect import bisect_left, bisect_right
+
+
+def normalize_name(name):
+    """
+    Normalizes a district name or number for lookups: case and surrounding
+    whitespace are ignored, runs of whitespace are collapsed, and leading
+    zeros are stripped from numbers (so "07" and "7" match).
+
+    :param string name: District name or number
+    :rtype: string
+    """
+    name = re.sub(r'\s+', ' ', unicode(name).strip().lower())
+
+    if name.isdigit():
+        name = name.lstrip('0') or '0'
+
+    return name
+
+
+def _numeric(name):
+    try:
+        return int(name)
+    except ValueError:
+        return None
+
+
+class DistrictCatalog(object):
+    """
+    Every district known to the API, with indexes for constant-time lookups
+    by level and district, by ``kml_url``, and by normalized name.
+
+    Iterating over a catalog yields its levels, and ``catalog[level]`` returns
+    that level's sorted list of districts, so a catalog can be used wherever
+    the dict returned by ``DistrictApi.get_all_districts`` is expected.
+
+    :ivar dict districts: Dictionary indexed by electoral level, with each
+       item a sorted list of District objects
+    """
+
+    def __init__(self, districts, *args, **kwargs):
+        """
+        :param dict districts: Dictionary indexed by electoral level, with each
+           item a sorted list of District objects -- as returned by
+           ``DistrictApi.construct_all_locations_data``
+        """
+        self.districts = districts
+
+        self._by_key = {}
+        self._by_kml_url = {}
+        self._by_name = {}
+        self._by_name_any_level = {}
+        self._numeric = {}
+        self._names = {}
+
+        for level, level_districts in districts.iteritems():
+            numbers = []
+            names = []
+
+            for district in level_districts:
+                name = normalize_name(district.district)
+                self._by_key[(level, district.district)] = district
+                self._by_name.setdefault((level, name), district)
+                self._by_name_any_level.setdefault(name, []).append(district)
+
+                if district.kml_url:
+                    self._by_kml_url[district.kml_url] = district
+
+                number = _numeric(district.district)
+                if number is not None:
+                    numbers.append((number, district))
+                names.append((name, district))
+
+            # Lists from construct_all_locations_data are sorted numerically
+            # where both names are numbers and alphabetically otherwise, so
+            # numbered and named districts can be interleaved.  Keep separate
+            # sorted copies for range and prefix queries; sorting input that's
+            # already nearly in order is cheap.
+            numbers.sort(key=lambda item: item[0])
+            self._numeric[level] = ([number for number, district in numbers],
+                [district for number, district in numbers])
+
+            names.sort(key=lambda item: item[0])
+            self._names[level] = ([name for name, district in names],
+                [district for name, district in names])
+
+        super(DistrictCatalog, self).__init__(*args, **kwargs)
+
+    def __repr__(self):
+        return '<DistrictCatalog levels=%r districts=%d>' % (
+            sorted(self.districts), len(self))
+
+    def __len__(self):
+        return len(self._by_key)
+
+    def __iter__(self):
+        return iter(self.districts)
+
+    def __getitem__(self, level):
+        return self.districts[level]
+
+    def __contains__(self, level):
+        return level in self.districts
+
+    def levels(self):
+        """
+        :returns: Electoral levels in the catalog
+        :rtype: list of strings
+        """
+        return self.districts.keys()
+
+    def get(self, level, district, default=None):
+        """
+        Looks up a district by its exact level and name or number.
+
+        :param string level: Electoral level (e.g. "State Senate")
+        :param string district: District name or number, exactly as the API
+           returns it (e.g. "24")
+        :returns: The matching District, or ``default``
+        """
+        return self._by_key.get((level, district), default)
+
+    def by_kml_url(self, kml_url, default=None):
+        """
+        :param string kml_url: URL of a district's KML file
+        :returns: The district with that ``kml_url``, or ``default``
+        """
+        return self._by_kml_url.get(kml_url, default)
+
+    def find(self, name, level=None):
+        """
+        Looks up districts by name, ignoring case, whitespace and leading
+        zeros (see ``normalize_name``).
+
+        :param string name: District name or number (e.g. "upper west side",
+           "024")
+        :param string level: *(optional)* Only look within this level
+        :returns: If ``level`` is given, the matching District or None.
+           Otherwise, a list of matching districts across all levels.
+        """
+        name = normalize_name(name)
+
+        if level is None:
+            return list(self._by_name_any_level.get(name, []))
+
+        return self._by_name.get((level, name))
+
+    def range(self, level, low=None, high=None):
+        """
+        Numbered districts within a range.  Districts whose names aren't
+        numbers are ignored.
+
+        :param string level: Electoral level
+        :param int low: *(optional)* Lowest district number to include
+        :param int high: *(optional)* Highest district number to include
+        :returns: Matching districts, in numeric order
+        :rtype: list of District objects
+        """
+        numbers, districts = self._numeric.get(level, ([], []))
+        start = 0 if low is None else bisect_left(numbers, low)
+        end = len(numbers) if high is None else bisect_right(numbers, high)
+        return districts[start:end]
+
+    def prefix(self, level, prefix):
+        """
+        Districts whose normalized names start with a prefix.
+
+        :param string level: Electoral level
+        :param string prefix: Start of the district name
+        :returns: Matching districts, in order of normalized name
+        :rtype: list of District objects
+        """
+        prefix = re.sub(r'\s+', ' ', unicode(prefix).lower()).lstrip()
+        names, districts = self._names.get(level, ([], []))
+        start = bisect_left(names, prefix)
+        end = bisect_left(names, prefix + u'\uffff')
+        return districts[start:end]
+
+    def diff(self, other):
+        """
+        Compares this catalog with a newer one.
+
+        :param DistrictCatalog other: The newer catalog
+        :returns: Districts added, removed and changed in ``other``
+        :rtype: CatalogDiff
+        """
+        added = [district for key, district in other._by_key.iteritems()
+            if key not in self._by_key]
+        removed = [district for key, district in self._by_key.iteritems()
+            if key not in other._by_key]
+        changed = [(district, other._by_key[key]) for key, district in
+            self._by_key.iteritems() if key in other._by_key and
+            district != other._by_key[key]]
+
+        return CatalogDiff(added, removed, changed)
+
+
+class CatalogDiff(object):
+    """
+    Differences between two snapshots of the district catalog.  Districts are
+    matched by level and district name or number.
+
+    :ivar list added: Districts only in the newer catalog
+    :ivar list removed: Districts only in the older catalog
+    :ivar list changed: ``(old, new)`` pairs of District objects whose other
+       attributes (i.e. ``kml_url``) differ
+    """
+
+    def __init__(self, added=None, removed=None, changed=None, *args,
+        **kwargs):
+        """
+        :param list added: Districts only in the newer catalog
+        :param list removed: Districts only in the older catalog
+        :param list changed: ``(old, new)`` pairs of changed districts
+        """
+        self.added = sorted(added or [], key=_sort_key)
+        self.removed = sorted(removed or [], key=_sort_key)
+        self.changed = sorted(changed or [], key=lambda pair: _sort_key(
+            pair[1]))
+
+        super(CatalogDiff, self).__init__(*args, **kwargs)
+
+    def __repr__(self):
+        return '<CatalogDiff added=%d removed=%d changed=%d>' % (
+            len(self.added), len(self.removed), len(self.changed))
+
+    def __nonzero__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def __len__(self):
+        return len(self.added) + len(self.removed) + len(self.changed)
+
+    def levels(self):
+        """
+        :returns: Electoral levels with at least one difference
+        :rtype: set
+        """
+        return set([district.level for district in self.added + self.removed]
+            + [new.level for old, new in self.changed])
+
+    def stale_kml_urls(self):
+        """
+        KML URLs whose boundaries should be discarded: those of removed
+        districts and the old URLs of changed districts.
+
+        :rtype: set
+        """
+        return set([district.kml_url for district in self.removed] +
+            [old.kml_url for old, new in self.changed]) - set([None])
+
+    def new_kml_urls(self):
+        """
+        KML URLs whose boundaries need fetching: those of added districts and
+        the new URLs of changed districts.
+
+        :rtype: set
+        """
+        return set([district.kml_url for district in self.added] +
+            [new.kml_url for old, new in self.changed]) - set([None])
+
+
+def _sort_key(district):
+    return (district.level, district.district)
+
+
+class CatalogFeed(object):
+    """
+    Keeps a current catalog, and tells subscribers what changed each time it's
+    refreshed -- so caches, boundaries and spatial indexes can update just the
+    affected districts instead of reloading everything.
+
+    Subscribers are callables taking ``(diff, catalog)``.  They're only called
+    when something changed.
+
+    :ivar DistrictCatalog catalog: The latest catalog, or None before the
+       first refresh
+    """
+
+    def __init__(self, client, catalog=None, *args, **kwargs):
+        """
+        :param DistrictApi client: Client from which to fetch the catalog
+        :param DistrictCatalog catalog: *(optional)* Catalog to diff the first
+           refresh against
+        """
+        self.client = client
+        self.catalog = catalog
+        self._subscribers = []
+
+        super(CatalogFeed, self).__init__(*args, **kwargs)
+
+    def subscribe(self, callback):
+        """
+        :param callable callback: Called with ``(diff, catalog)`` after each
+           refresh that changes the catalog
+        """
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        """
+        :param callable callback: Previously subscribed callable
+        """
+        self._subscribers.remove(callback)
+
+    def refresh(self, catalog=None):
+        """
+        Fetches the catalog, diffs it against the previous one and notifies
+        subscribers.
+
+        :param DistrictCatalog catalog: *(optional)* Use this catalog instead
+           of fetching one from the API
+        :raises: ApiUnavailable, AuthorizationError, QuotaExceeded, BadRequest,
+            LocationUnavailable, InvalidResponse, DistrictApiError
+        :returns: Differences from the previous catalog.  On the first refresh
+           every district counts as added.
+        :rtype: CatalogDiff
+        """
+        if catalog is None:
+            catalog = self.client.get_district_catalog()
+
+        # The client hands back the same catalog while the API reports it
+        # unchanged
+        if catalog is self.catalog:
+            return CatalogDiff()
+
+        previous = self.catalog or DistrictCatalog({})
+        diff = previous.diff(catalog)
+        self.catalog = catalog
+
+        if diff:
+            for callback in list(self._subscribers):
+                callback(diff, catalog)
+
+        return diff
@@ -1,11 +1,136 @@
+from collections import Counter
+
+# Longest response body excerpt kept by an exception
+EXCERPT_LENGTH = 200
+
+
+def excerpt(value, length=EXCERPT_LENGTH):
+    """
+    :param value: Response body, or data parsed from it
+    :param int length: *(optional)* Maximum length of the excerpt
+    :returns: The start of ``value`` (or of its ``repr``, if it isn't a 
+       string), marked with "..." if it was cut short
+    :rtype: string
+    """
+    if not isinstance(value, basestring):
+        value = repr(value)
+        
+    if len(value) > length:
+        return value[:length] + '...'
+        
+    return value
+
 
 class DistrictApiError(Exception):
     """
     Parent class from which all other Districts API errors inherit.
     
     Used for any other generic exceptions.
+    
+    Errors hold compact details about what went wrong, rather than the 
+    response itself, so that collecting many of them (say, one per failed 
+    location in a bulk run) doesn't keep response bodies and connections 
+    alive.
+    
+    :ivar string message: Description of the error
+    :ivar int status_code: HTTP status code of the response, if any
+    :ivar string excerpt: Start of the response body (see ``excerpt``)
+    :ivar list errors: Errors reported in the response body
+    :ivar tuple lat_lng: Location being looked up, or None for all-districts
+       queries
+    :ivar requests.Response response: The response itself, only if the client
+       was asked to keep it (``DistrictApi(keep_responses=True)``)
     """
-    pass
+    
+    def __init__(self, message=None, status_code=None, excerpt=None, 
+        errors=None, lat_lng=None, response=None):
+        """
+        :param string message: *(optional)* Description of the error
+        :param int status_code: *(optional)* HTTP status code
+        :param string excerpt: *(optional)* Start of the response body
+        :param list errors: *(optional)* Errors reported in the response body
+        :param tuple lat_lng: *(optional)* Location being looked up
+        :param requests.Response response: *(optional)* Response to keep
+        """
+        args = (message,) if message is not None else ()
+        super(DistrictApiError, self).__init__(*args)
+        
+        self.message = message
+        self.status_code = status_code
+        self.excerpt = excerpt
+        self.errors = errors
+        self.lat_lng = lat_lng
+        self.response = response
+        
+    @classmethod
+    def from_response(cls, response, message=None, lat_lng=None, 
+        keep_response=False):
+        """
+        :param requests.Response response: Response that caused the error
+        :param string message: *(optional)* Description of the error.  
+           Defaults to one based on the status code.
+        :param tuple lat_lng: *(optional)* Location being looked up
+        :param bool keep_response: *(optional)* Keep a reference to the 
+           response itself
+        :returns: Error with the response's status code and an excerpt of its
+           body
+        """
+        status_code = getattr(response, 'status_code', None)
+        if message is None:
+            message = 'HTTP %s' % status_code
+            
+        try:
+            text = response.text
+        except Exception:
+            text = None
+            
+        return cls(message, status_code=status_code, 
+            excerpt=excerpt(text) if isinstance(text, basestring) else None, 
+            lat_lng=lat_lng, response=response if keep_response else None)
+        
+    @property
+    def kind(self):
+        """
+        Key for aggregating errors: the error class and HTTP status code.
+        
+        :rtype: tuple
+        """
+        return (self.__class__.__name__, self.status_code)
+        
+    def __str__(self):
+        details = [self.message] if self.message is not None else []
+        if self.errors:
+            details.append('errors=%r' % (self.errors,))
+        if self.lat_lng is not None:
+            details.append('lat_lng=%r' % (self.lat_lng,))
+        if self.excerpt:
+            details.append('body=%r' % self.excerpt)
+            
+        return ' '.join('%s' % detail for detail in details)
+        
+    def __reduce__(self):
+        # The response, if kept, doesn't survive pickling
+        return (self.__class__, (self.message, self.status_code, 
+            self.excerpt, self.errors, self.lat_lng))
+            
+            
+def count_errors(errors):
+    """
+    Tallies errors by ``DistrictApiError.kind``.
+    
+    :param errors: Iterable of exceptions
+    :returns: Counts indexed by ``(class name, status code)``.  Exceptions 
+       that aren't DistrictApiErrors are counted with a status code of None.
+    :rtype: collections.Counter
+    """
+    counts = Counter()
+    for error in errors:
+        kind = getattr(error, 'kind', None)
+        if kind is None:
+            kind = (error.__class__.__name__, None)
+        counts[kind] += 1
+        
+    return counts
 
 class ApiUnavailable(DistrictApiError):
     """
@@ -32,10 +157,10 @@ class AuthorizationError(DistrictApiError):
     
 class QuotaExceeded(DistrictApiError):
     """
-    Currently unused (because we haven't hit our quota and thus haven't been 
-    able to see what the API returns in this case!)
+    Raised when the API responds with a 429 status, or when every key in the
+    client's ``KeyPool`` has used up its rate or daily budget.
         
-    When we do get this running, well, it'll mean you've exceeded your quota.
+    Either way, it means you've exceeded your quota.
     """
     pass
     
@@ -52,4 +177,14 @@ class InvalidResponse(DistrictApiError):
     """
     Raised if dict parsed from JSON doesn't contain the keys / values expected.
     """
-    pass   
\ No newline at end of file
+    pass   
+    
+    
+class NotModified(DistrictApiError):
+    """
+    Raised when a conditional request gets a 304 response, meaning the data 
+    hasn't changed since it was last retrieved.  ``DistrictApi`` handles this
+    itself, so you should only see it if you send conditional requests 
+    yourself.
+    """
+    pass
@@ -0,0 +1,178 @@
+"""
+.. module:: frames
+   :synopsis: Annotate pandas DataFrames (or Arrow record batches) with
+      districts.
+
+.. moduleauthor:: Noemi Millman <noemi@triopter.com>
+"""
+
+from district_api.lazy import lazy_import
+from district_api.exceptions import LocationUnavailable
+from district_api.spatial import spatial_join
+
+# pandas is an optional dependency, only needed by this module
+pandas = lazy_import('pandas')
+numpy = lazy_import('numpy')
+
+FIELDS = ('district', 'kml_url')
+
+
+def column_name(level, field):
+    """
+    :param string level: Electoral level (e.g. "State Senate")
+    :param string field: ``district`` or ``kml_url``
+    :returns: Name of the column holding ``field`` for ``level``
+    :rtype: string
+    """
+    return '%s %s' % (level, field)
+
+
+def _resolve(coords, resolver):
+    # Returns a list of {level: District} dicts, one per coordinate pair
+    if isinstance(resolver, dict):
+        # Boundaries: look everything up in one spatial join
+        joined = spatial_join(coords, resolver, groups=True)
+        results = [{} for coord in coords]
+
+        for level, groups in joined.iteritems():
+            for district, indices in groups.iteritems():
+                for index in indices:
+                    results[index][level] = district
+
+        return results
+
+    if hasattr(resolver, 'locate'):
+        lookup = resolver.locate
+    elif hasattr(resolver, 'get_districts'):
+        lookup = resolver.get_districts
+    else:
+        lookup = resolver
+
+    results = []
+    for coord in coords:
+        try:
+            results.append(lookup(coord))
+        except LocationUnavailable:
+            results.append({})
+
+    return results
+
+
+def annotate_frame(df, resolver, lat='lat', lng='lng', levels=None,
+    catalog=None, cache=None):
+    """
+    Adds district columns to a DataFrame.
+
+    Each distinct coordinate pair is only looked up once, and the results are
+    joined back onto the rows as categorical columns named by
+    ``column_name`` -- e.g. "State Senate district" and
+    "State Senate kml_url".  Rows with missing coordinates, or outside every
+    district at a level, get nulls.
+
+    :param pandas.DataFrame df: Frame to annotate.  It isn't modified.
+    :param resolver: How to look up districts.  One of:
+
+       * a ``DistrictApi`` (one API request per distinct location)
+       * an object with a ``locate(lat_lng)`` method, such as
+         ``shared.SharedIndex``
+       * a boundaries dict, as returned by ``DistrictApi.get_boundaries``
+         (all locations are resolved in one ``spatial.spatial_join``)
+       * any callable taking a ``(lat, lng)`` tuple and returning a dict of
+         District objects indexed by level
+
+    :param string lat: *(optional)* Name of the latitude column
+    :param string lng: *(optional)* Name of the longitude column
+    :param list levels: *(optional)* Levels for which to add columns.
+       Defaults to every level in ``catalog`` if one is given, otherwise to
+       every level found in this frame.
+    :param catalog: *(optional)* Catalog whose districts are used as the
+       categories of each column.  Pass one when annotating a frame in chunks
+       so that every chunk gets the same columns and categories.
+    :type catalog: catalog.DistrictCatalog or dict
+    :param dict cache: *(optional)* Dict mapping ``(lat, lng)`` tuples to
+       results, shared between calls so that locations seen in earlier chunks
+       aren't looked up again
+    :returns: Copy of ``df`` with district columns added
+    :rtype: pandas.DataFrame
+    """
+    if cache is None:
+        cache = {}
+
+    keys = pandas.MultiIndex.from_arrays([df[lat].values, df[lng].values])
+    codes, uniques = pandas.factorize(keys)
+
+    # Look up the coordinates we haven't seen before
+    coords = [(float(y), float(x)) for y, x in uniques]
+    missing = [coord for coord in set(coords) if coord not in cache and
+        coord[0] == coord[0] and coord[1] == coord[1]]
+    for coord, result in zip(missing, _resolve(missing, resolver)):
+        cache[coord] = result
+
+    results = [cache.get(coord, {}) for coord in coords]
+
+    if levels is None:
+        if catalog is not None:
+            levels = sorted(catalog)
+        else:
+            levels = sorted(set(level for result in results for level in
+                result))
+
+    annotated = df.copy()
+    for level in levels:
+        if catalog is not None:
+            known = list(catalog[level]) if level in catalog else []
+        else:
+            known = [result[level] for result in results if level in result]
+
+        for field in FIELDS:
+            categories = sorted(set(getattr(district, field) for district in
+                known) - set([None]))
+            positions = dict((value, i) for i, value in enumerate(categories))
+
+            # Category code for each distinct location, then for each row.
+            # factorize gives missing keys a code of -1, which picks up the
+            # trailing -1 here and so comes out null.
+            unique_codes = numpy.array([positions.get(getattr(
+                result[level], field), -1) if level in result else -1
+                for result in results] + [-1], dtype='int64')
+            row_codes = unique_codes[codes]
+
+            annotated[column_name(level, field)] = \
+                pandas.Categorical.from_codes(row_codes, categories)
+
+    return annotated
+
+
+def annotate_batches(batches, resolver, lat='lat', lng='lng', levels=None,
+    catalog=None, cache_size=1000000):
+    """
+    Annotates a stream of frames, for data too large to hold in memory at
+    once -- e.g. ``pyarrow.parquet.ParquetFile(path).iter_batches()`` or
+    ``pandas.read_csv(path, chunksize=...)``.
+
+    Lookups are cached across batches.  See ``annotate_frame`` for the
+    meaning of the other arguments.
+
+    Batches only share a schema -- as they must to be appended to one Parquet
+    file or Arrow stream -- if ``levels`` is fixed: pass ``levels``, or a
+    ``catalog`` to take them from.  Otherwise each batch gets columns for
+    just the levels its own locations fall in.
+
+    :param batches: Iterable of pandas DataFrames, or of objects with a
+       ``to_pandas()`` method (such as Arrow record batches or tables)
+    :param int cache_size: *(optional)* Maximum number of distinct locations
+       to remember between batches.  The cache is emptied when it fills up.
+    :returns: Annotated DataFrames, one per batch
+    :rtype: generator of pandas.DataFrame
+    """
+    cache = {}
+
+    for batch in batches:
+        if hasattr(batch, 'to_pandas'):
+            batch = batch.to_pandas()
+
+        if len(cache) > cache_size:
+            cache.clear()
+
+        yield annotate_frame(batch, resolver, lat=lat, lng=lng, levels=levels,
+            catalog=catalog, cache=cache)
@@ -0,0 +1,495 @@
+"""
+.. module:: geometry
+   :synopsis: District boundary shapes, and helpers to read them from KML.
+
+.. moduleauthor:: Noemi Millman <noemi@triopter.com>
+"""
+
+from __future__ import division
+
+import io
+from array import array
+
+from district_api.lazy import lazy_import
+
+# The C parser is several times faster for large KML files; it's missing
+# from some Python builds
+ElementTree = lazy_import('xml.etree.cElementTree', 'xml.etree.ElementTree')
+
+
+def ring_bbox(coords):
+    """
+    :param coords: Flat sequence of ring coordinates -- x0, y0, x1, y1, ...
+    :returns: Bounding box of the ring, as (min_x, min_y, max_x, max_y)
+    :rtype: tuple of floats
+    """
+    xs = coords[0::2]
+    ys = coords[1::2]
+    return (min(xs), min(ys), max(xs), max(ys))
+
+
+def ring_area(coords):
+    """
+    :param coords: Flat sequence of ring coordinates -- x0, y0, x1, y1, ...
+    :returns: Area enclosed by the ring (shoelace formula), in square 
+       coordinate units
+    :rtype: float
+    """
+    total = 0.0
+    count = len(coords)
+    x1 = coords[count - 2]
+    y1 = coords[count - 1]
+
+    for i in xrange(0, count, 2):
+        x2 = coords[i]
+        y2 = coords[i + 1]
+        total += x1 * y2 - x2 * y1
+        x1 = x2
+        y1 = y2
+
+    return abs(total) / 2.0
+
+
+def point_segment_distance(x, y, x1, y1, x2, y2):
+    """
+    :returns: Distance from (x, y) to the segment (x1, y1)-(x2, y2)
+    :rtype: float
+    """
+    dx = x2 - x1
+    dy = y2 - y1
+    length = dx * dx + dy * dy
+
+    if length:
+        t = max(0.0, min(1.0, ((x - x1) * dx + (y - y1) * dy) / length))
+        x1 += t * dx
+        y1 += t * dy
+
+    return ((x - x1) ** 2 + (y - y1) ** 2) ** 0.5
+
+
+def simplify_ring(coords, tolerance):
+    """
+    Removes vertices from a ring with the Douglas-Peucker algorithm.
+
+    Every removed vertex lies within ``tolerance`` of the simplified ring, and
+    every point of the simplified ring lies within ``tolerance`` of the
+    original.  Moving the boundary by no more than ``tolerance`` can't change
+    whether a point is inside it unless the point is within ``tolerance`` of
+    the true boundary, so containment tests can only be affected for points
+    that close to the edge.
+
+    :param coords: Flat sequence of ring coordinates -- x0, y0, x1, y1, ...
+    :param float tolerance: Maximum distance, in coordinate units (degrees for
+       KML), by which the simplified ring may stray from the original
+    :returns: Simplified, closed ring, or None if the ring collapses to a line
+       or a point at this tolerance
+    :rtype: array.array or None
+    """
+    xs = coords[0::2]
+    ys = coords[1::2]
+    count = len(xs)
+
+    # Treat the ring as closed whether or not the last vertex repeats the first
+    if count > 1 and xs[0] == xs[-1] and ys[0] == ys[-1]:
+        count -= 1
+
+    if count < 3:
+        return None
+
+    # Split the ring at the vertex farthest from the first, and simplify each
+    # half as an open line
+    far = max(xrange(count), key=lambda i: (xs[i] - xs[0]) ** 2 +
+        (ys[i] - ys[0]) ** 2)
+    keep = [False] * (count + 1)
+    keep[0] = keep[far] = keep[count] = True
+
+    xs = list(xs[:count]) + [xs[0]]
+    ys = list(ys[:count]) + [ys[0]]
+
+    stack = [(0, far), (far, count)]
+    while stack:
+        first, last = stack.pop()
+        worst = None
+        worst_distance = tolerance
+
+        for i in xrange(first + 1, last):
+            distance = point_segment_distance(xs[i], ys[i], xs[first],
+                ys[first], xs[last], ys[last])
+            if distance > worst_distance:
+                worst = i
+                worst_distance = distance
+
+        if worst is not None:
+            keep[worst] = True
+            stack.append((first, worst))
+            stack.append((worst, last))
+
+    simplified = array('d')
+    for i in xrange(count + 1):
+        if keep[i]:
+            simplified.append(xs[i])
+            simplified.append(ys[i])
+
+    # a closed ring needs at least three distinct vertices
+    if len(simplified) < 8:
+        return None
+
+    return simplified
+
+
+def ring_contains(coords, x, y):
+    """
+    Even-odd ray casting test for a single ring.
+
+    :param coords: Flat sequence of ring coordinates -- x0, y0, x1, y1, ...
+       The ring may or may not repeat its first vertex at the end.
+    :param float x: X coordinate (longitude) of the point to test
+    :param float y: Y coordinate (latitude) of the point to test
+    :returns: True if a ray cast from the point crosses the ring an odd number
+       of times
+    :rtype: bool
+    """
+    inside = False
+    count = len(coords)
+    x1 = coords[count - 2]
+    y1 = coords[count - 1]
+
+    for i in xrange(0, count, 2):
+        x2 = coords[i]
+        y2 = coords[i + 1]
+
+        if (y2 > y) != (y1 > y) and \
+            x < (x1 - x2) * (y - y2) / (y1 - y2) + x2:
+            inside = not inside
+
+        x1 = x2
+        y1 = y2
+
+    return inside
+
+
+def bbox_contains(bbox, x, y):
+    """
+    :param tuple bbox: Bounding box, as (min_x, min_y, max_x, max_y)
+    :returns: True if the point lies within the bounding box (inclusive)
+    :rtype: bool
+    """
+    return bbox[0] <= x <= bbox[2] and bbox[1] <= y <= bbox[3]
+
+
+def bbox_overlaps(a, b):
+    """
+    :param tuple a: Bounding box, as (min_x, min_y, max_x, max_y)
+    :param tuple b: Bounding box, as (min_x, min_y, max_x, max_y)
+    :returns: True if the bounding boxes overlap (edges included)
+    :rtype: bool
+    """
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def segment_intersects_bbox(x1, y1, x2, y2, bbox):
+    """
+    :param tuple bbox: Bounding box, as (min_x, min_y, max_x, max_y)
+    :returns: True if the segment (x1, y1)-(x2, y2) touches the bounding box
+    :rtype: bool
+    """
+    if not bbox_overlaps((min(x1, x2), min(y1, y2), max(x1, x2),
+        max(y1, y2)), bbox):
+        return False
+
+    # The segment misses the box only if all four corners lie strictly on
+    # the same side of the segment's line
+    sides = set()
+    for x, y in ((bbox[0], bbox[1]), (bbox[2], bbox[1]), (bbox[0], bbox[3]),
+        (bbox[2], bbox[3])):
+        cross = (x2 - x1) * (y - y1) - (y2 - y1) * (x - x1)
+        sides.add((cross > 0) - (cross < 0))
+
+    return sides != set([1]) and sides != set([-1])
+
+
+def ring_segments(coords):
+    """
+    :param coords: Flat sequence of ring coordinates -- x0, y0, x1, y1, ...
+    :returns: Each edge of the ring, as (x1, y1, x2, y2)
+    :rtype: generator of tuples
+    """
+    count = len(coords)
+    x1 = coords[count - 2]
+    y1 = coords[count - 1]
+
+    for i in xrange(0, count, 2):
+        x2 = coords[i]
+        y2 = coords[i + 1]
+        if x1 != x2 or y1 != y2:
+            yield (x1, y1, x2, y2)
+        x1 = x2
+        y1 = y2
+
+
+class Polygon(object):
+    """
+    A polygon, possibly with holes.
+
+    Coordinates are stored as flat arrays of doubles (x0, y0, x1, y1, ...),
+    with x being longitude and y latitude, as in KML.
+
+    :ivar list rings: Flat coordinate arrays; the first is the outer boundary
+       and any others are holes
+    :ivar tuple bbox: Bounding box, as (min_x, min_y, max_x, max_y)
+    :ivar list areas: Area enclosed by each ring, in square coordinate units
+    """
+
+    def __init__(self, rings, *args, **kwargs):
+        """
+        :param list rings: Sequences of flat ring coordinates, outer boundary
+           first
+        """
+        self.rings = [array('d', ring) for ring in rings]
+
+        if not self.rings or len(self.rings[0]) < 6:
+            raise ValueError('A polygon needs an outer ring of at least three '
+                'points')
+
+        self.bbox = ring_bbox(self.rings[0])
+        self.areas = [ring_area(ring) for ring in self.rings]
+
+        super(Polygon, self).__init__(*args, **kwargs)
+
+    def __repr__(self):
+        return '<Polygon rings=%d bbox=%r>' % (len(self.rings), self.bbox)
+
+    @property
+    def area(self):
+        """
+        Area of the outer ring less the area of the holes
+        """
+        return self.areas[0] - sum(self.areas[1:])
+
+    def vertex_count(self):
+        """
+        :returns: Total number of vertices across all rings
+        :rtype: int
+        """
+        return sum(len(ring) // 2 for ring in self.rings)
+
+    def simplify(self, tolerance):
+        """
+        :param float tolerance: Maximum distance, in coordinate units, by
+           which the simplified boundary may stray from this one.  See
+           ``simplify_ring``.
+        :returns: Simplified copy of this polygon, or None if its outer ring
+           collapses at this tolerance
+        :rtype: Polygon or None
+        """
+        rings = [simplify_ring(ring, tolerance) for ring in self.rings]
+        if rings[0] is None:
+            return None
+
+        return Polygon([ring for ring in rings if ring is not None])
+
+    def contains(self, x, y):
+        """
+        :param float x: Longitude of the point to test
+        :param float y: Latitude of the point to test
+        :rtype: bool
+        """
+        if not bbox_contains(self.bbox, x, y):
+            return False
+
+        # Even-odd rule across all rings handles holes for us
+        inside = False
+        for ring in self.rings:
+            if ring_contains(ring, x, y):
+                inside = not inside
+
+        return inside
+
+
+class MultiPolygon(object):
+    """
+    The boundary of a district: one or more polygons.
+
+    :ivar list polygons: List of ``Polygon`` objects
+    :ivar tuple bbox: Bounding box of all polygons, as
+       (min_x, min_y, max_x, max_y)
+    """
+
+    def __init__(self, polygons, *args, **kwargs):
+        """
+        :param list polygons: List of ``Polygon`` objects
+        """
+        self.polygons = list(polygons)
+
+        if not self.polygons:
+            raise ValueError('A MultiPolygon needs at least one polygon')
+
+        bboxes = [polygon.bbox for polygon in self.polygons]
+        self.bbox = (
+            min(bbox[0] for bbox in bboxes),
+            min(bbox[1] for bbox in bboxes),
+            max(bbox[2] for bbox in bboxes),
+            max(bbox[3] for bbox in bboxes),
+        )
+
+        super(MultiPolygon, self).__init__(*args, **kwargs)
+
+    def __repr__(self):
+        return '<MultiPolygon polygons=%d bbox=%r>' % (len(self.polygons),
+            self.bbox)
+
+    @property
+    def area(self):
+        """
+        Total area of all polygons
+        """
+        return sum(polygon.area for polygon in self.polygons)
+
+    def vertex_count(self):
+        """
+        :returns: Total number of vertices across all polygons
+        :rtype: int
+        """
+        return sum(polygon.vertex_count() for polygon in self.polygons)
+
+    def segments(self):
+        """
+        :returns: Every edge of every ring, as (x1, y1, x2, y2)
+        :rtype: generator of tuples
+        """
+        for polygon in self.polygons:
+            for ring in polygon.rings:
+                for segment in ring_segments(ring):
+                    yield segment
+
+    def contains(self, x, y):
+        """
+        :param float x: Longitude of the point to test
+        :param float y: Latitude of the point to test
+        :rtype: bool
+        """
+        if not bbox_contains(self.bbox, x, y):
+            return False
+
+        for polygon in self.polygons:
+            if polygon.contains(x, y):
+                return True
+
+        return False
+
+
+def _local_name(tag):
+    # KML files turn up with several different namespaces, so we match on
+    # the tag name alone
+    return tag.rsplit('}', 1)[-1]
+
+
+def parse_coordinates(text):
+    """
+    Parses the contents of a KML ``<coordinates>`` element.
+
+    :param string text: Whitespace-separated "lng,lat[,alt]" tuples
+    :returns: Flat coordinate array (lng0, lat0, lng1, lat1, ...)
+    :rtype: array.array
+    """
+    coords = array('d')
+    for point in text.split():
+        parts = point.split(',')
+        coords.append(float(parts[0]))
+        coords.append(float(parts[1]))
+
+    return coords
+
+
+def iter_kml_polygons(source, tolerance=None):
+    """
+    Reads polygons from a KML document one at a time, without building a tree
+    of the whole document.  Elements are detached from the tree as soon as
+    they have been read, so memory use is bounded by the largest polygon
+    rather than the size of the file.
+
+    :param source: Filename or file-like object containing the KML document
+    :param float tolerance: *(optional)* If given, simplify each polygon with
+       this tolerance (see ``simplify_ring``).  Polygons that collapse are
+       skipped.
+    :raises: SyntaxError (ElementTree.ParseError)
+    :returns: Polygons in document order
+    :rtype: generator of Polygon objects
+    """
+    outer = []
+    inner = []
+    boundary = None
+    # Elements started but not yet ended, outermost first
+    open_elements = []
+
+    for event, element in ElementTree.iterparse(source, events=('start', 
+        'end')):
+        name = _local_name(element.tag)
+
+        if event == 'start':
+            open_elements.append(element)
+            if name in ('outerBoundaryIs', 'innerBoundaryIs'):
+                boundary = name
+            continue
+
+        open_elements.pop()
+
+        if name == 'coordinates':
+            if boundary == 'outerBoundaryIs':
+                outer.append(parse_coordinates(element.text or ''))
+            elif boundary == 'innerBoundaryIs':
+                inner.append(parse_coordinates(element.text or ''))
+
+        elif name in ('outerBoundaryIs', 'innerBoundaryIs'):
+            boundary = None
+
+        elif name == 'Polygon':
+            if outer:
+                polygon = Polygon(outer[:1] + inner)
+                if tolerance:
+                    polygon = polygon.simplify(tolerance)
+                if polygon is not None:
+                    yield polygon
+
+            outer = []
+            inner = []
+
+        # The element and everything before it has been read; clearing just
+        # the element would leave it, empty, attached to its parent (and a
+        # <Document> of 100,000 empty placemarks is still large)
+        if open_elements:
+            open_elements[-1].clear()
+
+
+def read_kml(source, tolerance=None):
+    """
+    Extracts the polygons from a KML document.  See ``iter_kml_polygons``.
+
+    :param source: Filename or file-like object containing the KML document
+    :param float tolerance: *(optional)* Simplify polygons with this tolerance
+    :raises: ValueError, SyntaxError (ElementTree.ParseError)
+    :returns: All polygons in the document
+    :rtype: MultiPolygon
+    """
+    polygons = list(iter_kml_polygons(source, tolerance))
+
+    if not polygons:
+        raise ValueError('KML document contains no polygons')
+
+    return MultiPolygon(polygons)
+
+
+def parse_kml(text, tolerance=None):
+    """
+    Extracts the polygons from a KML document held in a string.
+
+    :param string text: KML document
+    :param float tolerance: *(optional)* Simplify polygons with this tolerance
+    :raises: ValueError, SyntaxError (ElementTree.ParseError)
+    :returns: All polygons in the document
+    :rtype: MultiPolygon
+    """
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+
+    return read_kml(io.BytesIO(text), tolerance)
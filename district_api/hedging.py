@@ -0,0 +1,224 @@
+"""
+.. module:: hedging
+   :synopsis: Hedged requests, to cut the tail latency of slow API responses.
+
+.. moduleauthor:: Noemi Millman <noemi@triopter.com>
+"""
+
+import sys
+import time
+import threading
+import Queue
+from collections import deque
+
+
+class HedgePolicy(object):
+    """
+    Decides when to send a duplicate ("hedge") request, and keeps count of how
+    often that happens.
+
+    If a request hasn't completed within the configured percentile of recently
+    observed latencies, a second identical request is sent and whichever one
+    answers first is used.  The number of hedges is capped at a fraction of
+    the total number of requests so that hedging can't more than marginally
+    increase the load on the API.
+
+    :ivar float percentile: Latency percentile (0-100) after which a hedge is
+       sent
+    :ivar float max_extra_load: Maximum number of hedges, as a fraction of
+       requests sent
+    :ivar int min_samples: Number of latencies that must be observed before
+       any hedge is sent
+    :ivar float min_delay: Lower bound, in seconds, on the delay before a
+       hedge is sent
+    :ivar int requests: Number of requests made through this policy
+    :ivar int hedges_fired: Number of hedge requests sent
+    :ivar int hedges_won: Number of times the hedge answered before the
+       original request
+    """
+
+    def __init__(self, percentile=95, max_extra_load=0.05, min_samples=20,
+        window=200, min_delay=0.0, *args, **kwargs):
+        """
+        :param float percentile: *(optional)* Latency percentile (0-100) after
+           which a hedge is sent.  Defaults to 95.
+        :param float max_extra_load: *(optional)* Maximum number of hedges, as
+           a fraction of requests sent.  Defaults to 0.05.
+        :param int min_samples: *(optional)* Number of latencies that must be
+           observed before any hedge is sent.  Defaults to 20.
+        :param int window: *(optional)* Number of recent latencies from which
+           the percentile is computed.  Defaults to 200.
+        :param float min_delay: *(optional)* Lower bound, in seconds, on the
+           delay before a hedge is sent.
+        """
+        if not 0 < percentile <= 100:
+            raise ValueError('percentile must be between 0 and 100')
+
+        self.percentile = percentile
+        self.max_extra_load = max_extra_load
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+
+        self.requests = 0
+        self.hedges_fired = 0
+        self.hedges_won = 0
+
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+        super(HedgePolicy, self).__init__(*args, **kwargs)
+
+    def record(self, latency):
+        """
+        Adds an observed latency to the window from which the hedge delay is
+        computed.
+
+        :param float latency: Request latency, in seconds
+        """
+        with self._lock:
+            self._latencies.append(latency)
+
+    def delay(self):
+        """
+        :returns: Number of seconds to wait before sending a hedge, or None if
+           too few latencies have been observed yet
+        :rtype: float or None
+        """
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            latencies = sorted(self._latencies)
+
+        index = int(round(self.percentile / 100.0 * (len(latencies) - 1)))
+        return max(latencies[index], self.min_delay)
+
+    def allow_hedge(self):
+        """
+        :returns: True if sending another hedge would stay within
+           ``max_extra_load``
+        :rtype: bool
+        """
+        with self._lock:
+            return self.hedges_fired + 1 <= self.max_extra_load * self.requests
+
+    def _claim_hedge(self):
+        # Checks the cap and counts the hedge in one step, so that concurrent
+        # slow calls can't all pass the check before any of them is counted
+        with self._lock:
+            if self.hedges_fired + 1 > self.max_extra_load * self.requests:
+                return False
+            self.hedges_fired += 1
+            return True
+
+    def stats(self):
+        """
+        :returns: Counters for requests sent, hedges fired and hedges won
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'hedges_fired': self.hedges_fired,
+                'hedges_won': self.hedges_won,
+            }
+
+    def call(self, func, *args, **kwargs):
+        """
+        Calls ``func(*args, **kwargs)``, sending a duplicate call if the first
+        one is slow, and returns the result of whichever finishes first.
+        See ``run``.
+
+        :param callable func: Function that sends the request (e.g.
+           ``requests.get``)
+        """
+        return self.run(func, args, kwargs)
+
+    def run(self, func, args=(), kwargs=None, on_hedge=None):
+        """
+        Calls ``func(*args, **kwargs)``, sending a duplicate call if the first
+        one is slow, and returns the result of whichever finishes first.
+
+        If the first call to finish raises an exception while the other is
+        still running, the other call's outcome is used instead.  The latency
+        of every call that succeeds is recorded, including a slow original
+        that a hedge beat, and the losing result is closed (if it has a
+        ``close`` method, as ``requests.Response`` does) so that it doesn't
+        hold a connection open.
+
+        :param callable func: Function that sends the request (e.g.
+           ``requests.get``)
+        :param tuple args: *(optional)* Positional arguments for ``func``
+        :param dict kwargs: *(optional)* Keyword arguments for ``func``
+        :param callable on_hedge: *(optional)* Called with no arguments just
+           before a hedge is sent, e.g. to count it against a quota
+        """
+        kwargs = kwargs or {}
+
+        with self._lock:
+            self.requests += 1
+
+        results = Queue.Queue()
+        decided = []
+        decided_lock = threading.Lock()
+
+        def run(hedged, started):
+            try:
+                value = func(*args, **kwargs)
+            except Exception:
+                results.put((hedged, False, sys.exc_info()[1]))
+                return
+
+            self.record(time.time() - started)
+
+            # Only the first success is handed back; a later one has lost
+            with decided_lock:
+                lost = bool(decided)
+                decided.append(hedged)
+
+            if lost:
+                close = getattr(value, 'close', None)
+                if close is not None:
+                    close()
+                return
+
+            results.put((hedged, True, value))
+
+        def start(hedged):
+            thread = threading.Thread(target=run, args=(hedged, time.time()))
+            thread.daemon = True
+            thread.start()
+
+        start(False)
+        outstanding = 1
+
+        delay = self.delay()
+        if delay is not None:
+            try:
+                outcome = results.get(timeout=delay)
+            except Queue.Empty:
+                outcome = None
+                if self._claim_hedge():
+                    if on_hedge is not None:
+                        on_hedge()
+                    start(True)
+                    outstanding += 1
+        else:
+            outcome = None
+
+        while True:
+            if outcome is None:
+                outcome = results.get()
+            outstanding -= 1
+
+            hedged, succeeded, value = outcome
+            if succeeded or not outstanding:
+                break
+            outcome = None
+
+        if succeeded:
+            if hedged:
+                with self._lock:
+                    self.hedges_won += 1
+            return value
+
+        raise value
@@ -0,0 +1,241 @@
+"""
+.. module:: hierarchy
+   :synopsis: Overlay of every level's boundaries, so one lookup resolves all
+      levels at once.
+
+.. moduleauthor:: Noemi Millman <noemi@triopter.com>
+"""
+
+from __future__ import division
+
+from collections import defaultdict
+
+from district_api.geometry import bbox_overlaps, segment_intersects_bbox
+from district_api.spatial import GridIndex
+
+
+class _Cell(object):
+    # One node of the overlay.  Leaves carry the districts every point in the
+    # cell belongs to, plus (for cells that boundaries pass through) the
+    # candidates still to be tested for each unresolved level.
+    __slots__ = ('districts', 'pending', 'children', 'mid_x', 'mid_y')
+
+    def __init__(self, districts, pending=None, children=None, mid_x=None,
+        mid_y=None):
+        self.districts = districts
+        self.pending = pending
+        self.children = children
+        self.mid_x = mid_x
+        self.mid_y = mid_y
+
+
+class HierarchyIndex(object):
+    """
+    Precomputed overlay of the boundaries of every electoral level.
+
+    The area covered by the boundaries is divided into a grid, and cells that
+    boundaries pass through are split into quarters, down to ``max_depth``
+    times.  A cell that no boundary passes through lies wholly inside (or
+    outside) one district of every level, so it's tagged with the full set of
+    districts up front; one lookup of the cell containing a point then
+    answers for every level at once, with no polygon tests at all.  Only in
+    the few cells along boundaries -- and then only for the levels whose
+    boundaries cross them -- do polygons still have to be tested.
+
+    :ivar list levels: Electoral levels in the index
+    :ivar GridIndex grid: Top-level grid
+    :ivar int max_depth: Number of times cells crossed by a boundary are
+       subdivided
+    """
+
+    def __init__(self, boundaries, cell_size=None, max_depth=4, *args,
+        **kwargs):
+        """
+        :param dict boundaries: Boundaries indexed by electoral level, with
+           each item a list of ``(District, MultiPolygon)`` pairs -- as
+           returned by ``DistrictApi.get_boundaries``
+        :param float cell_size: *(optional)* Top-level grid cell size, in
+           degrees.  Defaults to 1/32nd of the extent of all boundaries.
+        :param int max_depth: *(optional)* Number of times to subdivide cells
+           that boundaries pass through.  Defaults to 4.
+        """
+        self.levels = sorted(boundaries)
+        self.max_depth = max_depth
+
+        # Sets of districts are shared between all cells that have them
+        self._interned = {}
+
+        bboxes = [boundary.bbox for level in self.levels
+            for district, boundary in boundaries[level]]
+        if bboxes:
+            extent = (min(bbox[0] for bbox in bboxes),
+                min(bbox[1] for bbox in bboxes),
+                max(bbox[2] for bbox in bboxes),
+                max(bbox[3] for bbox in bboxes))
+        else:
+            extent = (0.0, 0.0, 1.0, 1.0)
+
+        if cell_size is None:
+            cell_size = max(extent[2] - extent[0], extent[3] - extent[1],
+                1e-9) / 32
+
+        self.grid = GridIndex(cell_size, extent[0], extent[1])
+
+        # For each top-level cell and level: the districts whose bounding
+        # boxes overlap the cell, and the boundary edges passing through it
+        candidates = defaultdict(lambda: defaultdict(list))
+        for level in self.levels:
+            for district, boundary in boundaries[level]:
+                for cell in self.grid.cells_for_bbox(boundary.bbox):
+                    candidates[cell][level].append((district, boundary, []))
+
+        for level in self.levels:
+            for district, boundary in boundaries[level]:
+                edges = defaultdict(list)
+                for segment in boundary.segments():
+                    x1, y1, x2, y2 = segment
+                    for cell in self.grid.cells_for_bbox((min(x1, x2),
+                        min(y1, y2), max(x1, x2), max(y1, y2))):
+                        if segment_intersects_bbox(x1, y1, x2, y2,
+                            self._cell_bbox(cell)):
+                            edges[cell].append(segment)
+
+                for cell, segments in edges.iteritems():
+                    for candidate in candidates[cell][level]:
+                        if candidate[1] is boundary:
+                            candidate[2].extend(segments)
+
+        self._cells = {}
+        for cell, by_level in candidates.iteritems():
+            self._cells[cell] = self._build(self._cell_bbox(cell), by_level,
+                {}, 0)
+
+        super(HierarchyIndex, self).__init__(*args, **kwargs)
+
+    def __repr__(self):
+        return '<HierarchyIndex levels=%r cells=%d>' % (self.levels,
+            len(self._cells))
+
+    def _cell_bbox(self, cell):
+        size = self.grid.cell_size
+        min_x = self.grid.origin_x + cell[0] * size
+        min_y = self.grid.origin_y + cell[1] * size
+        return (min_x, min_y, min_x + size, min_y + size)
+
+    def _intern(self, districts):
+        key = tuple(sorted((level, id(district)) for level, district in
+            districts.iteritems()))
+        return self._interned.setdefault(key, districts)
+
+    def _build(self, bbox, by_level, inherited, depth):
+        # inherited holds the levels already resolved for a parent cell
+        districts = dict(inherited)
+        pending = {}
+        center_x = (bbox[0] + bbox[2]) / 2
+        center_y = (bbox[1] + bbox[3]) / 2
+
+        for level in sorted(by_level):
+            crossing = []
+            for district, boundary, segments in by_level[level]:
+                if not bbox_overlaps(boundary.bbox, bbox):
+                    continue
+
+                if segments:
+                    crossing.append((district, boundary, segments))
+
+                # Districts at the same level don't overlap, so a district
+                # that no boundary crosses and that contains the center
+                # contains the whole cell
+                elif boundary.contains(center_x, center_y):
+                    districts[level] = district
+                    crossing = None
+                    break
+
+            if crossing:
+                pending[level] = crossing
+
+        if not pending or depth >= self.max_depth:
+            leftover = [(level, [(district, boundary) for district, boundary,
+                segments in pending[level]]) for level in sorted(pending)]
+            return _Cell(self._intern(districts), leftover or None)
+
+        children = []
+        for j in (0, 1):
+            for i in (0, 1):
+                child_bbox = (
+                    bbox[0] if i == 0 else center_x,
+                    bbox[1] if j == 0 else center_y,
+                    center_x if i == 0 else bbox[2],
+                    center_y if j == 0 else bbox[3],
+                )
+                child_by_level = {}
+                for level, candidates in by_level.iteritems():
+                    if level in districts:
+                        continue
+                    child_by_level[level] = [(district, boundary,
+                        [segment for segment in segments if
+                        segment_intersects_bbox(segment[0], segment[1],
+                        segment[2], segment[3], child_bbox)])
+                        for district, boundary, segments in candidates]
+
+                children.append(self._build(child_bbox, child_by_level,
+                    districts, depth + 1))
+
+        return _Cell(None, children=children, mid_x=center_x, mid_y=center_y)
+
+    def locate(self, lat_lng):
+        """
+        Finds the districts containing a location, at every level.
+
+        :param lat_lng: 2-tuple of latitude and longitude floats
+        :type lat_lng: tuple of floats
+        :returns: Dictionary of District objects, indexed by level -- the same
+           shape as ``DistrictApi.get_districts`` returns
+        :rtype: dict
+        """
+        y = float(lat_lng[0])
+        x = float(lat_lng[1])
+
+        node = self._cells.get(self.grid.cell_of(x, y))
+        if node is None:
+            return {}
+
+        while node.children is not None:
+            node = node.children[(x >= node.mid_x) + 2 * (y >= node.mid_y)]
+
+        found = dict(node.districts)
+        if node.pending:
+            for level, candidates in node.pending:
+                for district, boundary in candidates:
+                    if boundary.contains(x, y):
+                        found[level] = district
+                        break
+
+        return found
+
+    def stats(self):
+        """
+        :returns: Number of leaf cells that resolve every level outright
+           (``atomic``), number that still need polygon tests along a boundary
+           (``boundary``), and number of distinct sets of districts
+           (``district_sets``)
+        :rtype: dict
+        """
+        atomic = 0
+        boundary = 0
+        stack = self._cells.values()
+
+        while stack:
+            node = stack.pop()
+            if node.children is not None:
+                stack.extend(node.children)
+            elif node.pending:
+                boundary += 1
+            else:
+                atomic += 1
+
+        return {
+            'atomic': atomic,
+            'boundary': boundary,
+            'district_sets': len(self._interned),
+        }
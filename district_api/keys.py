@@ -0,0 +1,307 @@
+"""
+.. module:: keys
+   :synopsis: Pool of API keys with per-key quota accounting.
+
+.. moduleauthor:: Noemi Millman <noemi@triopter.com>
+"""
+
+import time
+import calendar
+import threading
+
+from district_api.exceptions import QuotaExceeded
+
+
+class ApiKey(object):
+    """
+    A single API key, along with its limits and usage counters.
+
+    :ivar string key: The API key itself
+    :ivar float rate: Maximum number of requests per second allowed for this
+       key, or None for no limit
+    :ivar int daily_budget: Maximum number of requests per day allowed for
+       this key, or None for no limit
+    :ivar float sidelined_until: Time until which the key is out of rotation
+       because the API rejected it: ``float('inf')`` if for good, or None if
+       the key is in rotation
+    """
+
+    def __init__(self, key, rate=None, daily_budget=None, *args, **kwargs):
+        """
+        :param string key: The API key itself
+        :param float rate: *(optional)* Maximum requests per second
+        :param int daily_budget: *(optional)* Maximum requests per day
+        """
+        self.key = key
+        self.rate = rate
+        self.daily_budget = daily_budget
+        self.sidelined_until = None
+
+        # usage within the current one-second window and the current day
+        self.window_start = 0
+        self.window_count = 0
+        self.day = None
+        self.day_count = 0
+
+        super(ApiKey, self).__init__(*args, **kwargs)
+
+    def __repr__(self):
+        return '<ApiKey key=%r day_count=%r sidelined=%r>' % (
+            self.key, self.day_count, self.sidelined)
+
+    @property
+    def sidelined(self):
+        """
+        True if the key is currently out of rotation.
+        """
+        return self.sidelined_until is not None and \
+            time.time() < self.sidelined_until
+
+    def refresh(self, now):
+        """
+        Resets counters whose accounting window has expired.
+
+        :param float now: Current time, as returned by ``time.time()``
+        """
+        if now - self.window_start >= 1:
+            self.window_start = now
+            self.window_count = 0
+
+        today = time.gmtime(now)[:3]
+        if today != self.day:
+            self.day = today
+            self.day_count = 0
+
+    def load(self):
+        """
+        Fraction of this key's quota that has been used, taking whichever of
+        the per-second and per-day limits is closer to exhaustion.
+
+        :returns: Number between 0 and 1 (inclusive); 1 means the key can't be
+           used right now
+        :rtype: float
+        """
+        loads = [0.0]
+
+        if self.rate is not None:
+            loads.append(min(self.window_count / float(self.rate), 1.0))
+
+        if self.daily_budget is not None:
+            loads.append(min(self.day_count / float(self.daily_budget), 1.0))
+
+        return max(loads)
+
+    def available(self, now=None):
+        """
+        Also puts the key back into rotation once its sidelining expires.
+
+        :param float now: *(optional)* Current time.  Defaults to
+           ``time.time()``.
+        :returns: True if the key may be used for another request right now
+        :rtype: bool
+        """
+        if self.sidelined_until is not None:
+            if now is None:
+                now = time.time()
+            if now < self.sidelined_until:
+                return False
+            self.sidelined_until = None
+
+        return self.load() < 1
+
+    def budget_exhausted(self):
+        """
+        :returns: True if the key has used its whole daily budget
+        :rtype: bool
+        """
+        return self.daily_budget is not None and \
+            self.day_count >= self.daily_budget
+
+    def quota_reset(self, now):
+        """
+        :param float now: Current time, as returned by ``time.time()``
+        :returns: Time at which the key's quota next frees up: the start of
+           the next UTC day if its daily budget is used up, otherwise the end
+           of the current one-second window (or of one starting now, if the
+           current one has already run out)
+        :rtype: float
+        """
+        if self.budget_exhausted():
+            year, month, day = time.gmtime(now)[:3]
+            return calendar.timegm((year, month, day, 0, 0, 0)) + 86400
+
+        if self.window_start + 1 > now:
+            return self.window_start + 1
+
+        return now + 1
+
+    def record(self):
+        """
+        Counts one request against this key's quota.
+        """
+        self.window_count += 1
+        self.day_count += 1
+
+
+class KeyPool(object):
+    """
+    Set of API keys among which requests are spread.
+
+    Each request goes to the least loaded key that hasn't exhausted its
+    quota.  Keys rejected by the API are sidelined and skipped: for good if
+    the API refused them, or until their quota frees up if the API said it
+    was exceeded.
+
+    :ivar list keys: List of ``ApiKey`` objects in the pool
+    """
+
+    def __init__(self, keys, rate=None, daily_budget=None, *args, **kwargs):
+        """
+        :param keys: API keys.  Items may be strings or ``ApiKey`` objects.
+        :type keys: list
+        :param float rate: *(optional)* Default per-second limit for keys
+           given as strings
+        :param int daily_budget: *(optional)* Default per-day limit for keys
+           given as strings
+        """
+        self.keys = []
+        for key in keys:
+            if not isinstance(key, ApiKey):
+                key = ApiKey(key, rate=rate, daily_budget=daily_budget)
+            self.keys.append(key)
+
+        if not self.keys:
+            raise ValueError('KeyPool requires at least one API key')
+
+        self._by_key = dict((key.key, key) for key in self.keys)
+        self._lock = threading.Lock()
+
+        super(KeyPool, self).__init__(*args, **kwargs)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __repr__(self):
+        return '<KeyPool %r>' % self.keys
+
+    def _least_loaded(self, now):
+        best = None
+        best_load = None
+
+        for key in self.keys:
+            key.refresh(now)
+            if not key.available(now):
+                continue
+
+            load = key.load()
+            if best is None or load < best_load:
+                best = key
+                best_load = load
+
+        return best
+
+    def select(self):
+        """
+        Returns the key that would be used for the next request, without
+        counting it against its quota.
+
+        :raises: QuotaExceeded
+        :rtype: string
+        """
+        with self._lock:
+            key = self._least_loaded(time.time())
+
+        if key is None:
+            raise QuotaExceeded('No API key has quota remaining')
+
+        return key.key
+
+    def acquire(self, block=True):
+        """
+        Picks the least loaded available key and counts a request against it.
+
+        If every key has used up its per-second allowance, waits for the
+        earliest one-second window to reopen.
+
+        :param bool block: *(optional)* Raise QuotaExceeded instead of
+           waiting for a rate window to reopen
+        :raises: QuotaExceeded, if every key is sidelined or has used up its
+           daily budget
+        :returns: API key string
+        :rtype: string
+        """
+        while True:
+            now = time.time()
+
+            with self._lock:
+                key = self._least_loaded(now)
+                if key is not None:
+                    key.record()
+                    return key.key
+
+                # Keys that are only held back by their rate limit
+                reopens = [api_key.window_start + 1 for api_key in self.keys
+                    if api_key.sidelined_until is None and
+                    not api_key.budget_exhausted()]
+
+            if not block or not reopens:
+                raise QuotaExceeded('No API key has quota remaining')
+
+            time.sleep(max(min(reopens) - now, 0.001))
+
+    def record(self, key):
+        """
+        Counts a request made outside ``acquire`` (e.g. a hedged duplicate)
+        against a key's quota.
+
+        :param string key: API key string
+        """
+        with self._lock:
+            api_key = self._by_key[key]
+            api_key.refresh(time.time())
+            api_key.record()
+
+    def sideline(self, key, permanent=True):
+        """
+        Takes a key out of rotation (e.g. because the API rejected it).
+
+        :param string key: API key string
+        :param bool permanent: *(optional)* If False, the key is only
+           sidelined until its quota next frees up (see
+           ``ApiKey.quota_reset``).  Otherwise it stays out of rotation until
+           ``reinstate`` is called.
+        """
+        now = time.time()
+
+        with self._lock:
+            api_key = self._by_key[key]
+            if permanent:
+                api_key.sidelined_until = float('inf')
+            else:
+                api_key.refresh(now)
+                api_key.sidelined_until = api_key.quota_reset(now)
+
+    def reinstate(self, key):
+        """
+        Puts a previously sidelined key back into rotation.
+
+        :param string key: API key string
+        """
+        with self._lock:
+            self._by_key[key].sidelined_until = None
+
+    def available_count(self):
+        """
+        :returns: Number of keys that can currently accept a request
+        :rtype: int
+        """
+        now = time.time()
+
+        with self._lock:
+            count = 0
+            for key in self.keys:
+                key.refresh(now)
+                if key.available(now):
+                    count += 1
+
+        return count
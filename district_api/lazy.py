@@ -0,0 +1,69 @@
+"""
+.. module:: lazy
+   :synopsis: Deferred imports, to keep the package quick to load.
+
+.. moduleauthor:: Noemi Millman <noemi@triopter.com>
+"""
+
+import sys
+import importlib
+
+
+class LazyModule(object):
+    """
+    Stands in for a module that hasn't been imported yet.  The real module is
+    imported the first time one of its attributes is accessed, and every
+    access after that is passed straight through to it.
+
+    Because attributes are looked up on the real module each time, patching
+    the real module (e.g. ``mock.patch('requests.get')``) works as usual.
+    """
+
+    def __init__(self, name, fallback=None):
+        """
+        :param string name: Full dotted name of the module
+        :param string fallback: *(optional)* Full dotted name of a module to
+           import instead if ``name`` can't be imported
+        """
+        self.__dict__['_name'] = name
+        self.__dict__['_fallback'] = fallback
+        self.__dict__['_module'] = None
+
+    def __repr__(self):
+        state = 'loaded' if self._loaded() else 'not loaded'
+        return '<LazyModule %s (%s)>' % (self._name, state)
+
+    def _loaded(self):
+        return self._module is not None or self._name in sys.modules
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            try:
+                module = importlib.import_module(self._name)
+            except ImportError:
+                if self._fallback is None:
+                    raise
+                module = importlib.import_module(self._fallback)
+            self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+
+def lazy_import(name, fallback=None):
+    """
+    :param string name: Full dotted name of the module
+    :param string fallback: *(optional)* Full dotted name of a module to use
+       instead if ``name`` can't be imported
+    :returns: The module itself if it has already been imported elsewhere,
+       otherwise a ``LazyModule`` that imports it on first use
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+
+    return LazyModule(name, fallback)
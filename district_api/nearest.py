@@ -0,0 +1,286 @@
+"""
+.. module:: nearest
+   :synopsis: Distance-to-boundary and nearest-district queries.
+
+.. moduleauthor:: Noemi Millman <noemi@triopter.com>
+"""
+
+from __future__ import division
+
+import math
+import heapq
+import itertools
+
+from district_api.geometry import point_segment_distance, bbox_contains
+from district_api.spatial import GridIndex
+
+# Metres per degree of latitude, and of longitude at the equator
+METERS_PER_DEGREE_LAT = 110574.0
+METERS_PER_DEGREE_LNG = 111320.0
+
+
+def boundary_confidence(distance, scale=50.0):
+    """
+    Turns a distance from the nearest boundary into a confidence score: 0 on
+    the boundary itself, approaching 1 far away from it.
+
+    :param float distance: Distance from the nearest boundary, in metres
+    :param float scale: *(optional)* Distance, in metres, at which confidence
+       reaches about 0.63.  Defaults to 50.
+    :rtype: float
+    """
+    return 1 - math.exp(-distance / scale)
+
+
+def _bbox_distance(bbox, x, y):
+    dx = max(bbox[0] - x, 0.0, x - bbox[2])
+    dy = max(bbox[1] - y, 0.0, y - bbox[3])
+    return math.sqrt(dx * dx + dy * dy)
+
+
+class SegmentTree(object):
+    """
+    R-tree of line segments, bulk-loaded with the Sort-Tile-Recursive
+    algorithm, for nearest-segment queries in logarithmic time.
+
+    :ivar int size: Number of segments in the tree
+    """
+
+    def __init__(self, segments, node_capacity=16, *args, **kwargs):
+        """
+        :param segments: Iterable of ``(x1, y1, x2, y2, owner)`` tuples;
+           ``owner`` is returned by ``nearest`` along with the distance
+        :param int node_capacity: *(optional)* Maximum children per node
+        """
+        self.node_capacity = node_capacity
+
+        # Each node is (bbox, is_leaf, children)
+        nodes = [((min(s[0], s[2]), min(s[1], s[3]), max(s[0], s[2]),
+            max(s[1], s[3])), True, s) for s in segments]
+        self.size = len(nodes)
+
+        while len(nodes) > 1:
+            nodes = self._pack(nodes)
+
+        self._root = nodes[0] if nodes else None
+
+        super(SegmentTree, self).__init__(*args, **kwargs)
+
+    def __len__(self):
+        return self.size
+
+    def _pack(self, nodes):
+        # One level of Sort-Tile-Recursive packing: sort into vertical slices
+        # by x, then each slice into runs by y
+        capacity = self.node_capacity
+        parent_count = int(math.ceil(len(nodes) / capacity))
+        slice_size = int(math.ceil(math.sqrt(parent_count))) * capacity
+
+        nodes = sorted(nodes, key=lambda node: node[0][0] + node[0][2])
+        parents = []
+        for start in xrange(0, len(nodes), slice_size):
+            column = sorted(nodes[start:start + slice_size],
+                key=lambda node: node[0][1] + node[0][3])
+            for first in xrange(0, len(column), capacity):
+                children = column[first:first + capacity]
+                bbox = (min(child[0][0] for child in children),
+                    min(child[0][1] for child in children),
+                    max(child[0][2] for child in children),
+                    max(child[0][3] for child in children))
+                parents.append((bbox, False, children))
+
+        return parents
+
+    def nearest(self, x, y):
+        """
+        Best-first search for the segment nearest a point.
+
+        :returns: Distance to the nearest segment and that segment's owner, or
+           None if the tree is empty
+        :rtype: tuple or None
+        """
+        if self._root is None:
+            return None
+
+        # Heap entries are (distance, tiebreak, exact, node).  Nodes and
+        # leaves are first pushed with the distance to their bounding box,
+        # which can only underestimate; leaves are then pushed again with
+        # their exact distance, so the first exact entry popped is nearest.
+        counter = itertools.count()
+        heap = [(_bbox_distance(self._root[0], x, y), next(counter), False,
+            self._root)]
+
+        while heap:
+            distance, tiebreak, exact, node = heapq.heappop(heap)
+            bbox, is_leaf, payload = node
+
+            if exact:
+                return distance, payload[4]
+
+            if is_leaf:
+                heapq.heappush(heap, (point_segment_distance(x, y, payload[0],
+                    payload[1], payload[2], payload[3]), next(counter), True,
+                    node))
+                continue
+
+            for child in payload:
+                heapq.heappush(heap, (_bbox_distance(child[0], x, y),
+                    next(counter), False, child))
+
+
+class BoundaryIndex(object):
+    """
+    Index of district boundary edges, for finding how far a location is from
+    the nearest boundary and which district is closest to it.
+
+    Coordinates are projected onto a flat plane centred on the boundaries, so
+    distances are in metres and accurate to well under 1% across an area the
+    size of a city.
+
+    :ivar list levels: Electoral levels in the index
+    """
+
+    def __init__(self, boundaries, *args, **kwargs):
+        """
+        :param dict boundaries: Boundaries indexed by electoral level, with
+           each item a list of ``(District, MultiPolygon)`` pairs -- as
+           returned by ``DistrictApi.get_boundaries``
+        """
+        self.levels = sorted(boundaries)
+        self._boundaries = boundaries
+
+        bboxes = [boundary.bbox for level in self.levels
+            for district, boundary in boundaries[level]]
+        center_lat = (min(bbox[1] for bbox in bboxes) +
+            max(bbox[3] for bbox in bboxes)) / 2 if bboxes else 0.0
+        self._scale_x = METERS_PER_DEGREE_LNG * math.cos(math.radians(
+            center_lat))
+        self._scale_y = METERS_PER_DEGREE_LAT
+
+        sx = self._scale_x
+        sy = self._scale_y
+        self._trees = {}
+        for level in self.levels:
+            self._trees[level] = SegmentTree((x1 * sx, y1 * sy, x2 * sx,
+                y2 * sy, district) for district, boundary in boundaries[level]
+                for x1, y1, x2, y2 in boundary.segments())
+
+        # Grid of district bounding boxes for each level, so that finding the
+        # district containing a point only tests the few whose boxes cover
+        # its cell
+        self._grids = {}
+        for level in self.levels:
+            self._grids[level] = self._bbox_grid(boundaries[level])
+
+        super(BoundaryIndex, self).__init__(*args, **kwargs)
+
+    def __repr__(self):
+        return '<BoundaryIndex levels=%r>' % self.levels
+
+    def _bbox_grid(self, pairs):
+        # Cells about the size of an average district, so each district
+        # covers only a handful of them
+        if pairs:
+            cell_size = sum(max(boundary.bbox[2] - boundary.bbox[0],
+                boundary.bbox[3] - boundary.bbox[1]) for district, boundary
+                in pairs) / len(pairs)
+        else:
+            cell_size = 1.0
+
+        grid = GridIndex(max(cell_size, 1e-9))
+        cells = {}
+        for district, boundary in pairs:
+            for cell in grid.cells_for_bbox(boundary.bbox):
+                cells.setdefault(cell, []).append((district, boundary))
+
+        return grid, cells
+
+    def _project(self, lat_lng):
+        return float(lat_lng[1]) * self._scale_x, \
+            float(lat_lng[0]) * self._scale_y
+
+    def distance_to_boundary(self, lat_lng, level=None):
+        """
+        :param lat_lng: 2-tuple of latitude and longitude floats
+        :type lat_lng: tuple of floats
+        :param string level: *(optional)* Only consider this level's
+           boundaries.  Defaults to all levels.
+        :returns: Distance in metres to the nearest boundary, and the District
+           that boundary belongs to; or None if there are no boundaries
+        :rtype: tuple or None
+        """
+        x, y = self._project(lat_lng)
+        levels = self.levels if level is None else [level]
+
+        best = None
+        for level in levels:
+            found = self._trees[level].nearest(x, y)
+            if found is not None and (best is None or found[0] < best[0]):
+                best = found
+
+        return best
+
+    def nearest_district(self, lat_lng, level):
+        """
+        Finds the district containing a location or, failing that, the
+        closest one -- useful when the API reports a location just outside
+        its coverage (``LocationUnavailable``).
+
+        :param lat_lng: 2-tuple of latitude and longitude floats
+        :type lat_lng: tuple of floats
+        :param string level: Electoral level
+        :returns: The district, and the distance to it in metres (0 if the
+           location is inside it); or None if the level has no boundaries
+        :rtype: tuple or None
+        """
+        lng = float(lat_lng[1])
+        lat = float(lat_lng[0])
+
+        grid, cells = self._grids[level]
+        for district, boundary in cells.get(grid.cell_of(lng, lat), ()):
+            if bbox_contains(boundary.bbox, lng, lat) and \
+                boundary.contains(lng, lat):
+                return district, 0.0
+
+        found = self._trees[level].nearest(*self._project(lat_lng))
+        if found is None:
+            return None
+
+        return found[1], found[0]
+
+    def nearest_districts(self, lat_lng):
+        """
+        :param lat_lng: 2-tuple of latitude and longitude floats
+        :type lat_lng: tuple of floats
+        :returns: ``nearest_district`` results, indexed by level
+        :rtype: dict
+        """
+        found = {}
+        for level in self.levels:
+            result = self.nearest_district(lat_lng, level)
+            if result is not None:
+                found[level] = result
+
+        return found
+
+    def confidence(self, lat_lng, scale=50.0):
+        """
+        Scores how safely a location sits within its district at each level,
+        for use alongside ``DistrictApi.get_districts`` results: a location
+        right on a boundary scores 0, and scores approach 1 with distance.
+        See ``boundary_confidence``.
+
+        :param lat_lng: 2-tuple of latitude and longitude floats
+        :type lat_lng: tuple of floats
+        :param float scale: *(optional)* Distance, in metres, at which
+           confidence reaches about 0.63
+        :returns: Confidence scores, indexed by level
+        :rtype: dict
+        """
+        scores = {}
+        for level in self.levels:
+            found = self.distance_to_boundary(lat_lng, level)
+            if found is not None:
+                scores[level] = boundary_confidence(found[0], scale)
+
+        return scores
@@ -0,0 +1,363 @@
+"""
+.. module:: prefetch
+   :synopsis: Result cache with neighbourhood prefetching and warm-up from
+      access logs.
+
+.. moduleauthor:: Noemi Millman <noemi@triopter.com>
+"""
+
+from __future__ import division
+
+import time
+import threading
+import Queue
+from collections import OrderedDict, Counter
+
+from district_api.exceptions import LocationUnavailable
+
+
+def quantize(lat_lng, step):
+    """
+    :param lat_lng: 2-tuple of latitude and longitude floats
+    :param float step: Grid cell size, in degrees
+    :returns: Row and column of the grid cell containing the location
+    :rtype: tuple of ints
+    """
+    return (int(round(float(lat_lng[0]) / step)),
+        int(round(float(lat_lng[1]) / step)))
+
+
+class RateBudget(object):
+    """
+    Token bucket limiting how many requests per second may be spent on
+    background work.
+
+    :ivar float rate: Requests allowed per second
+    :ivar float burst: Maximum number of requests that may be made at once
+       after a quiet spell
+    """
+
+    def __init__(self, rate, burst=None, *args, **kwargs):
+        """
+        :param float rate: Requests allowed per second
+        :param float burst: *(optional)* Bucket size.  Defaults to ``rate``.
+        """
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self._tokens = self.burst
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+        super(RateBudget, self).__init__(*args, **kwargs)
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens +
+            (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self):
+        """
+        Spends one token if one is available.
+
+        :rtype: bool
+        """
+        with self._lock:
+            self._refill(time.time())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def acquire(self):
+        """
+        Spends one token, waiting for one to become available if necessary.
+        """
+        while True:
+            with self._lock:
+                self._refill(time.time())
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class ResultCache(object):
+    """
+    Thread-safe least-recently-used cache of lookup results, keyed by grid
+    cell.
+
+    :ivar int maxsize: Maximum number of cells to remember
+    """
+
+    def __init__(self, maxsize=100000, *args, **kwargs):
+        """
+        :param int maxsize: *(optional)* Maximum number of cells to remember
+        """
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+        super(ResultCache, self).__init__(*args, **kwargs)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                return default
+            self._data[key] = value
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+class PrefetchingClient(object):
+    """
+    Wraps a ``DistrictApi`` with a result cache that fills itself ahead of
+    demand.
+
+    Locations are snapped to a grid of ``step`` degrees and results are
+    cached per grid cell, so every location in a cell gets the result of the
+    first lookup there.  Pick a step small enough for that to be acceptable
+    near boundaries (0.0005 degrees is roughly 50 metres in NYC).
+
+    When a lookup lands in a cell not yet cached, the cells around it are
+    queued to be fetched by a background thread, at no more than ``rate``
+    requests per second.  Lookups that walk from cell to neighbouring cell --
+    canvassers going block by block, say -- then mostly hit the cache.
+
+    :ivar DistrictApi client: The wrapped client
+    :ivar float step: Grid cell size, in degrees
+    :ivar ResultCache cache: Cached results
+    :ivar dict stats: Counts of ``hits``, ``misses``, ``prefetched`` cells
+       and prefetches ``dropped`` because the queue was full
+    """
+
+    def __init__(self, client, step=0.0005, radius=1, rate=5.0,
+        max_pending=1000, cache=None, access_log=None, *args, **kwargs):
+        """
+        :param DistrictApi client: Client used to look up districts
+        :param float step: *(optional)* Grid cell size, in degrees
+        :param int radius: *(optional)* How many cells around each new cell
+           to prefetch.  0 turns prefetching off.
+        :param float rate: *(optional)* Maximum background requests per
+           second
+        :param int max_pending: *(optional)* Prefetches beyond this many
+           queued ones are dropped
+        :param ResultCache cache: *(optional)* Cache to fill.  Defaults to a
+           new ``ResultCache``.
+        :param access_log: *(optional)* File-like object to which the cell of
+           each lookup is written, one "lat,lng" line per lookup, for use by
+           ``warm_up`` on a later run
+        """
+        self.client = client
+        self.step = step
+        self.radius = radius
+        self.max_pending = max_pending
+        self.cache = cache if cache is not None else ResultCache()
+        self.access_log = access_log
+        self.budget = RateBudget(rate)
+        self.stats = {'hits': 0, 'misses': 0, 'prefetched': 0, 'dropped': 0}
+
+        self._queue = Queue.Queue()
+        self._queued = set()
+        # Cells being fetched right now, each with an event set when done
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._worker = None
+
+        super(PrefetchingClient, self).__init__(*args, **kwargs)
+
+    def _center(self, key):
+        return (key[0] * self.step, key[1] * self.step)
+
+    def _fetch(self, key, lat_lng):
+        try:
+            result = self.client.get_districts(lat_lng)
+        except LocationUnavailable as e:
+            # Remember that there's nothing here, too
+            result = e
+
+        self.cache.put(key, result)
+        return result
+
+    def _count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def get_districts(self, lat_lng):
+        """
+        Same as ``DistrictApi.get_districts``, but answered from the cache
+        when possible.
+
+        :raises: TypeError, ValueError, ApiUnavailable, AuthorizationError,
+            QuotaExceeded, BadRequest, LocationUnavailable, InvalidResponse,
+            DistrictApiError
+        :returns: Dictionary of District objects, indexed by level
+        :rtype: dict
+        """
+        key = quantize(lat_lng, self.step)
+
+        if self.access_log is not None:
+            with self._lock:
+                self.access_log.write('%r,%r\n' % self._center(key))
+
+        result = self.cache.get(key)
+        if result is None:
+            self._count('misses')
+            result = self._fetch_on_demand(key, lat_lng)
+            self._prefetch_around(key)
+        else:
+            self._count('hits')
+
+        if isinstance(result, LocationUnavailable):
+            raise result
+
+        return dict(result)
+
+    def _fetch_on_demand(self, key, lat_lng):
+        # If the cell is already being fetched, in the background or for
+        # another lookup, wait for that rather than fetching it twice.  If
+        # it's only queued, take it off the queue and fetch it now.
+        with self._lock:
+            pending = self._in_flight.get(key)
+            if pending is None:
+                self._queued.discard(key)
+                done = self._in_flight[key] = threading.Event()
+
+        if pending is not None:
+            pending.wait()
+            result = self.cache.get(key)
+            if result is not None:
+                return result
+
+            # That fetch failed; try again ourselves
+            return self._fetch(key, lat_lng)
+
+        try:
+            return self._fetch(key, lat_lng)
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            done.set()
+
+    def _prefetch_around(self, key):
+        for i in xrange(-self.radius, self.radius + 1):
+            for j in xrange(-self.radius, self.radius + 1):
+                if i or j:
+                    self._enqueue((key[0] + i, key[1] + j))
+
+    def _enqueue(self, key, force=False):
+        with self._lock:
+            if key in self._queued or key in self._in_flight or \
+                key in self.cache:
+                return False
+
+            if not force and len(self._queued) >= self.max_pending:
+                self.stats['dropped'] += 1
+                return False
+
+            self._queued.add(key)
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._work)
+                self._worker.daemon = True
+                self._worker.start()
+
+        self._queue.put(key)
+        return True
+
+    def _work(self):
+        while True:
+            key = self._queue.get()
+            try:
+                if key is None:
+                    return
+
+                if key in self.cache:
+                    continue
+
+                self.budget.acquire()
+
+                # Claim the cell, unless a lookup has taken it off the queue
+                # to fetch it on demand in the meantime
+                with self._lock:
+                    if key not in self._queued:
+                        continue
+                    self._queued.discard(key)
+                    done = self._in_flight[key] = threading.Event()
+
+                try:
+                    self._fetch(key, self._center(key))
+                    self._count('prefetched')
+                except Exception:
+                    # Background work mustn't take anything down -- network
+                    # errors from requests included; the cell will just be
+                    # fetched on demand instead
+                    pass
+                finally:
+                    with self._lock:
+                        del self._in_flight[key]
+                    done.set()
+
+            finally:
+                with self._lock:
+                    self._queued.discard(key)
+                self._queue.task_done()
+
+    def warm_up(self, lines, limit=1000):
+        """
+        Queues the most frequently looked-up cells from a previous run's
+        access log to be fetched in the background, hottest first.
+
+        :param lines: Iterable of "lat,lng" lines, e.g. an open access log
+        :param int limit: *(optional)* Maximum number of cells to fetch
+        :returns: Number of cells queued
+        :rtype: int
+        """
+        counts = Counter()
+        for line in lines:
+            try:
+                lat, lng = line.strip().split(',')
+                counts[quantize((lat, lng), self.step)] += 1
+            except ValueError:
+                continue
+
+        queued = 0
+        for key, count in counts.most_common(limit):
+            if self._enqueue(key, force=True):
+                queued += 1
+
+        return queued
+
+    def wait(self):
+        """
+        Blocks until every queued prefetch has been fetched.
+        """
+        self._queue.join()
+
+    def close(self):
+        """
+        Stops the background thread once the queue has been worked through.
+        """
+        with self._lock:
+            worker = self._worker
+            self._worker = None
+
+        if worker is not None:
+            self._queue.put(None)
+            worker.join()
@@ -0,0 +1,278 @@
+"""
+.. module:: profiling
+   :synopsis: Span tracing for finding where the time in API calls goes.
+
+.. moduleauthor:: Noemi Millman <noemi@triopter.com>
+"""
+
+import time
+import heapq
+import random
+import itertools
+import threading
+from timeit import default_timer
+from collections import deque, defaultdict
+
+# Query variables whose values are never recorded
+REDACTED_VARS = ('api-key',)
+
+
+class _NullSpan(object):
+    # Does nothing, as cheaply as possible
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class NullProfiler(object):
+    """
+    Stand-in used while profiling is off.  Every method is a no-op.
+    """
+
+    def span(self, name):
+        return _NULL_SPAN
+
+    def annotate(self, query_vars):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class Trace(object):
+    """
+    Timings of one top-level call.
+
+    :ivar string name: Name of the outermost span
+    :ivar float start: Wall-clock time at which the call started
+    :ivar float duration: Seconds the call took
+    :ivar dict query_vars: Query variables sent to the API, with the API key
+       redacted, or None if no request was sent
+    :ivar list spans: ``(path, offset, duration)`` tuples, in the order the
+       spans finished.  ``path`` is a tuple of span names from the outermost
+       in; ``offset`` is seconds since the start of the call.
+    """
+
+    def __init__(self, name, start, *args, **kwargs):
+        self.name = name
+        self.start = start
+        self.duration = None
+        self.query_vars = None
+        self.spans = []
+
+        super(Trace, self).__init__(*args, **kwargs)
+
+    def __repr__(self):
+        return '<Trace %s duration=%.6f query_vars=%r>' % (self.name,
+            self.duration or 0.0, self.query_vars)
+
+
+class _Span(object):
+
+    __slots__ = ('profiler', 'name', 'started', 'children')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.children = 0.0
+        self.started = self.profiler._enter(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler._exit(self, default_timer())
+        return False
+
+
+class _SkippedSpan(object):
+    # Outermost span of a call left out by sampling; nothing inside it is
+    # timed either
+    __slots__ = ('local',)
+
+    def __init__(self, local):
+        self.local = local
+
+    def __enter__(self):
+        self.local.skipping += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.local.skipping -= 1
+        return False
+
+
+class Profiler(object):
+    """
+    Records how long each phase of an API call takes.
+
+    Code being profiled wraps each phase in ``with profiler.span(name):``.
+    Spans nest; the outermost span of a call is recorded as a ``Trace``.  The
+    profiler keeps the most recent traces, the slowest traces seen, and the
+    total time spent in each stack of spans, which ``dump`` writes out in the
+    collapsed-stack format read by ``flamegraph.pl``, speedscope and the like.
+
+    It is safe to share one profiler between threads.
+
+    :ivar float sample: Fraction of calls that are traced
+    :ivar int slowest_count: Number of slowest traces kept
+    :ivar int recent_count: Number of most recent traces kept
+    """
+
+    def __init__(self, slowest=20, recent=1000, sample=1.0, *args,
+        **kwargs):
+        """
+        :param int slowest: *(optional)* Number of slowest traces to keep.
+           Defaults to 20.
+        :param int recent: *(optional)* Number of most recent traces to keep.
+           Defaults to 1000.
+        :param float sample: *(optional)* Fraction of calls to trace, chosen
+           at random.  Defaults to 1 (every call).
+        """
+        if not 0 < sample <= 1:
+            raise ValueError('sample must be greater than 0 and at most 1')
+
+        self.sample = sample
+        self.slowest_count = slowest
+        self.recent_count = recent
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self.reset()
+
+        super(Profiler, self).__init__(*args, **kwargs)
+
+    def reset(self):
+        """
+        Forgets everything recorded so far.
+        """
+        with self._lock:
+            self._recent = deque(maxlen=self.recent_count)
+            self._slowest = []
+            self._totals = defaultdict(float)
+
+    def _state(self):
+        local = self._local
+        if not hasattr(local, 'stack'):
+            local.stack = []
+            local.skipping = 0
+            local.trace = None
+        return local
+
+    def span(self, name):
+        """
+        :param string name: Name of the phase
+        :returns: Context manager timing the phase
+        """
+        local = self._state()
+
+        if local.skipping:
+            return _NULL_SPAN
+
+        if not local.stack and self.sample < 1 and \
+            random.random() >= self.sample:
+            return _SkippedSpan(local)
+
+        return _Span(self, name)
+
+    def annotate(self, query_vars):
+        """
+        Attaches the query variables of the request being made to the current
+        trace, with the API key redacted.
+
+        :param dict query_vars: Query variables, as built by
+           ``DistrictApi.construct_query_vars``
+        """
+        local = self._state()
+        if local.trace is None or local.skipping:
+            return
+
+        redacted = dict(query_vars)
+        for var in REDACTED_VARS:
+            if var in redacted:
+                redacted[var] = '<redacted>'
+        local.trace.query_vars = redacted
+
+    def _enter(self, span):
+        local = self._local
+        now = default_timer()
+        if not local.stack:
+            local.trace = Trace(span.name, time.time())
+            local.origin = now
+        local.stack.append(span)
+        return now
+
+    def _exit(self, span, now):
+        local = self._local
+        stack = local.stack
+        path = tuple(s.name for s in stack)
+        stack.pop()
+
+        duration = now - span.started
+        if stack:
+            stack[-1].children += duration
+
+        trace = local.trace
+        trace.spans.append((path, span.started - local.origin, duration))
+
+        with self._lock:
+            # Flame graphs want the time spent in each span itself, not
+            # counting the spans inside it
+            self._totals[path] += duration - span.children
+
+            if not stack:
+                trace.duration = duration
+                self._recent.append(trace)
+                entry = (duration, next(self._counter), trace)
+                if len(self._slowest) < self.slowest_count:
+                    heapq.heappush(self._slowest, entry)
+                elif self.slowest_count:
+                    heapq.heappushpop(self._slowest, entry)
+
+        if not stack:
+            local.trace = None
+
+    def traces(self):
+        """
+        :returns: The most recent traces, oldest first
+        :rtype: list of Trace
+        """
+        with self._lock:
+            return list(self._recent)
+
+    def slowest(self):
+        """
+        :returns: The slowest traces seen, slowest first
+        :rtype: list of Trace
+        """
+        with self._lock:
+            return [trace for duration, counter, trace in
+                sorted(self._slowest, reverse=True)]
+
+    def totals(self):
+        """
+        :returns: Seconds spent in each stack of spans, not counting time in
+           nested spans, indexed by tuples of span names
+        :rtype: dict
+        """
+        with self._lock:
+            return dict(self._totals)
+
+    def dump(self, fileobj):
+        """
+        Writes the aggregated profile in collapsed-stack format: one line per
+        stack of spans, with span names separated by semicolons and followed
+        by the total time in microseconds -- e.g.
+        ``get_districts;get_data;send_request 51234``.
+
+        :param fileobj: File-like object to write to
+        """
+        for path, seconds in sorted(self.totals().iteritems()):
+            fileobj.write('%s %d\n' % (';'.join(path),
+                int(round(seconds * 1e6))))
@@ -0,0 +1,287 @@
+"""
+.. module:: shared
+   :synopsis: Read-only district index held in shared memory, for prefork
+      servers.
+
+.. moduleauthor:: Noemi Millman <noemi@triopter.com>
+"""
+
+from __future__ import division
+
+import os
+import json
+import math
+import mmap
+import struct
+import tempfile
+
+from district_api.api import District
+from district_api.geometry import bbox_contains, ring_contains, ring_bbox
+
+
+MAGIC = b'DAIX'
+VERSION = 2
+
+# magic, version, polygon count, ring count, coordinate count, grid columns,
+# grid rows, cell entry count, metadata length, cell size, grid origin x/y
+_header = struct.Struct('<4sIIIIIIII3d')
+# district id, first ring, ring count, bounding box
+_polygon = struct.Struct('<III4d')
+# offset of first coordinate (in doubles), number of coordinates, bounding
+# box
+_ring = struct.Struct('<II4d')
+_uint = struct.Struct('<I')
+
+
+class SharedIndex(object):
+    """
+    Point-in-district index stored as flat binary tables in a memory map.
+
+    The index is built once -- typically in the parent process of a prefork
+    server (e.g. at import time with gunicorn's ``preload_app``) -- and either
+    inherited by forked workers or attached from a file.  Polygons aren't
+    kept as Python objects; a lookup unpacks a ring's coordinates from the
+    map only if the point falls within the ring's bounding box, and discards
+    them afterwards.  Workers therefore never write to the shared pages (not
+    even to update reference counts), so the operating system keeps a single
+    copy no matter how many workers there are, and worker startup doesn't
+    depend on how long the index took to build.
+
+    :ivar string path: File backing the index, or None for an anonymous map
+    :ivar float cell_size: Width and height of each grid cell, in degrees
+    """
+
+    def __init__(self, buf, path=None, *args, **kwargs):
+        """
+        Use ``build`` or ``attach`` rather than instantiating directly.
+
+        :param buf: Memory map (or any buffer) containing the index
+        :param string path: *(optional)* File backing the memory map
+        """
+        (magic, version, self._polygon_count, self._ring_count,
+            self._coord_count, self._cols, self._rows, self._entry_count,
+            meta_length, self.cell_size, self._origin_x,
+            self._origin_y) = _header.unpack_from(buf, 0)
+
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Not a district index, or built by an '
+                'incompatible version')
+
+        self._buf = buf
+        self.path = path
+
+        # Offsets of each table within the buffer
+        self._polygons_at = _header.size
+        self._rings_at = self._polygons_at + \
+            self._polygon_count * _polygon.size
+        self._cells_at = self._rings_at + self._ring_count * _ring.size
+        self._entries_at = self._cells_at + \
+            (self._cols * self._rows + 1) * _uint.size
+        self._coords_at = self._entries_at + self._entry_count * _uint.size
+        self._meta_at = self._coords_at + self._coord_count * 8
+        self._meta_length = meta_length
+
+        # District objects are decoded on first use in each process
+        self._districts = None
+
+        super(SharedIndex, self).__init__(*args, **kwargs)
+
+    def __repr__(self):
+        return '<SharedIndex polygons=%d path=%r>' % (self._polygon_count,
+            self.path)
+
+    @classmethod
+    def build(cls, boundaries, path=None, cell_size=None):
+        """
+        Builds an index from district boundaries.
+
+        :param dict boundaries: Boundaries indexed by electoral level, with
+           each item a list of ``(District, MultiPolygon)`` pairs -- as
+           returned by ``DistrictApi.get_boundaries``
+        :param string path: *(optional)* Write the index to this file (e.g.
+           under ``/dev/shm``) so that unrelated processes can ``attach`` it.
+           By default the index lives in an anonymous shared memory map, which
+           is only visible to processes forked after it was built.
+        :param float cell_size: *(optional)* Grid cell size in degrees.
+           Defaults to 1/64th of the extent of all boundaries.
+        :rtype: SharedIndex
+        """
+        meta = []
+        polygons = []
+        rings = []
+        coords = []
+        coord_count = 0
+
+        for level in sorted(boundaries):
+            for district, boundary in boundaries[level]:
+                district_id = len(meta)
+                meta.append([district.level, district.district,
+                    district.kml_url])
+
+                for polygon in boundary.polygons:
+                    polygons.append(_polygon.pack(district_id, len(rings),
+                        len(polygon.rings), *polygon.bbox))
+                    for ring in polygon.rings:
+                        rings.append(_ring.pack(coord_count, len(ring),
+                            *ring_bbox(ring)))
+                        coords.append(struct.pack('<%dd' % len(ring), *ring))
+                        coord_count += len(ring)
+
+        bboxes = [_polygon.unpack(packed)[3:] for packed in polygons]
+        if bboxes:
+            extent = (min(bbox[0] for bbox in bboxes),
+                min(bbox[1] for bbox in bboxes),
+                max(bbox[2] for bbox in bboxes),
+                max(bbox[3] for bbox in bboxes))
+        else:
+            extent = (0.0, 0.0, 0.0, 0.0)
+
+        if cell_size is None:
+            cell_size = max(extent[2] - extent[0], extent[3] - extent[1]) / 64
+        cell_size = max(cell_size, 1e-9)
+
+        cols = int(math.floor((extent[2] - extent[0]) / cell_size)) + 1
+        rows = int(math.floor((extent[3] - extent[1]) / cell_size)) + 1
+
+        # Each cell lists the polygons whose bounding boxes overlap it, stored
+        # as one offset table plus one flat list of polygon ids
+        cells = [[] for i in xrange(cols * rows)]
+        for polygon_id, bbox in enumerate(bboxes):
+            min_i = int((bbox[0] - extent[0]) / cell_size)
+            max_i = int((bbox[2] - extent[0]) / cell_size)
+            min_j = int((bbox[1] - extent[1]) / cell_size)
+            max_j = int((bbox[3] - extent[1]) / cell_size)
+            for j in xrange(min_j, max_j + 1):
+                for i in xrange(min_i, max_i + 1):
+                    cells[j * cols + i].append(polygon_id)
+
+        offsets = [0]
+        entries = []
+        for cell in cells:
+            entries.extend(cell)
+            offsets.append(len(entries))
+
+        meta = json.dumps(meta).encode('utf-8')
+        data = b''.join([
+            _header.pack(MAGIC, VERSION, len(polygons), len(rings),
+                coord_count, cols, rows, len(entries), len(meta), cell_size,
+                extent[0], extent[1]),
+            b''.join(polygons),
+            b''.join(rings),
+            struct.pack('<%dI' % len(offsets), *offsets),
+            struct.pack('<%dI' % len(entries), *entries),
+            b''.join(coords),
+            meta,
+        ])
+
+        if path is None:
+            # Anonymous maps are shared (not copied) across fork on Unix
+            buf = mmap.mmap(-1, len(data))
+            buf.write(data)
+            return cls(buf)
+
+        # Write to a temporary file first, so that workers attaching
+        # mid-rebuild never see a partial index
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.rename(temp_path, path)
+        except Exception:
+            os.unlink(temp_path)
+            raise
+
+        return cls.attach(path)
+
+    @classmethod
+    def attach(cls, path):
+        """
+        Maps a previously built index read-only.
+
+        :param string path: File written by ``build``
+        :rtype: SharedIndex
+        """
+        with open(path, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        return cls(buf, path)
+
+    def close(self):
+        """
+        Unmaps the index.  It can't be used afterwards.
+        """
+        self._buf.close()
+
+    def districts(self):
+        """
+        :returns: Every district in the index, in index order
+        :rtype: list of District objects
+        """
+        if self._districts is None:
+            meta = self._buf[self._meta_at:self._meta_at + self._meta_length]
+            self._districts = [District(district, level, kml_url) for
+                level, district, kml_url in json.loads(meta.decode('utf-8'))]
+
+        return self._districts
+
+    def _polygon_contains(self, polygon_id, x, y):
+        district_id, first_ring, ring_count, min_x, min_y, max_x, max_y = \
+            _polygon.unpack_from(self._buf,
+                self._polygons_at + polygon_id * _polygon.size)
+
+        if not bbox_contains((min_x, min_y, max_x, max_y), x, y):
+            return None
+
+        inside = False
+        for ring_id in xrange(first_ring, first_ring + ring_count):
+            start, count, min_x, min_y, max_x, max_y = _ring.unpack_from(
+                self._buf, self._rings_at + ring_id * _ring.size)
+
+            # Most holes are nowhere near the point
+            if not bbox_contains((min_x, min_y, max_x, max_y), x, y):
+                continue
+
+            coords = struct.unpack_from('<%dd' % count, self._buf,
+                self._coords_at + start * 8)
+            if ring_contains(coords, x, y):
+                inside = not inside
+
+        return district_id if inside else None
+
+    def locate(self, lat_lng):
+        """
+        Finds the districts containing a location.
+
+        :param lat_lng: 2-tuple of latitude and longitude floats
+        :type lat_lng: tuple of floats
+        :returns: Dictionary of District objects, indexed by level -- the same
+           shape as ``DistrictApi.get_districts`` returns
+        :rtype: dict
+        """
+        y = float(lat_lng[0])
+        x = float(lat_lng[1])
+
+        i = int(math.floor((x - self._origin_x) / self.cell_size))
+        j = int(math.floor((y - self._origin_y) / self.cell_size))
+        if not (0 <= i < self._cols and 0 <= j < self._rows):
+            return {}
+
+        cell = j * self._cols + i
+        first = _uint.unpack_from(self._buf,
+            self._cells_at + cell * _uint.size)[0]
+        last = _uint.unpack_from(self._buf,
+            self._cells_at + (cell + 1) * _uint.size)[0]
+
+        districts = self.districts()
+        found = {}
+        for entry in xrange(first, last):
+            polygon_id = _uint.unpack_from(self._buf,
+                self._entries_at + entry * _uint.size)[0]
+            district_id = self._polygon_contains(polygon_id, x, y)
+
+            if district_id is not None:
+                district = districts[district_id]
+                found.setdefault(district.level, district)
+
+        return found
@@ -0,0 +1,332 @@
+"""
+.. module:: spatial
+   :synopsis: Spatial join of large point datasets against district boundaries.
+
+.. moduleauthor:: Noemi Millman <noemi@triopter.com>
+"""
+
+import math
+import itertools
+from array import array
+
+
+class GridIndex(object):
+    """
+    Partitions the plane into square cells, so that a shape only needs to be
+    tested against the points that fall in the cells its bounding box covers.
+
+    :ivar float cell_size: Width and height of each cell, in degrees
+    :ivar float origin_x: X coordinate (longitude) of the grid origin
+    :ivar float origin_y: Y coordinate (latitude) of the grid origin
+    """
+
+    def __init__(self, cell_size, origin_x=0.0, origin_y=0.0, *args, **kwargs):
+        """
+        :param float cell_size: Width and height of each cell, in degrees
+        :param float origin_x: *(optional)* Longitude of the grid origin
+        :param float origin_y: *(optional)* Latitude of the grid origin
+        """
+        if cell_size <= 0:
+            raise ValueError('cell_size must be positive')
+
+        self.cell_size = float(cell_size)
+        self.origin_x = origin_x
+        self.origin_y = origin_y
+
+        super(GridIndex, self).__init__(*args, **kwargs)
+
+    def cell_of(self, x, y):
+        """
+        :returns: Column and row of the cell containing the point
+        :rtype: tuple of ints
+        """
+        return (int(math.floor((x - self.origin_x) / self.cell_size)),
+            int(math.floor((y - self.origin_y) / self.cell_size)))
+
+    def cells_for_bbox(self, bbox):
+        """
+        :param tuple bbox: Bounding box, as (min_x, min_y, max_x, max_y)
+        :returns: Every cell that overlaps the bounding box
+        :rtype: generator of tuples of ints
+        """
+        min_i, min_j = self.cell_of(bbox[0], bbox[1])
+        max_i, max_j = self.cell_of(bbox[2], bbox[3])
+
+        for i in xrange(min_i, max_i + 1):
+            for j in xrange(min_j, max_j + 1):
+                yield (i, j)
+
+
+class PointGrid(object):
+    """
+    A set of points sorted by grid cell, so that the points in any cell can be
+    retrieved as one contiguous run.
+
+    Points are held in flat arrays of doubles, cells are identified by packed
+    integer keys and points are ordered with a counting sort on those keys,
+    so a grid of tens of millions of points costs a few dozen bytes per point
+    rather than several Python objects.
+
+    :ivar GridIndex grid: Grid by which the points are partitioned
+    :ivar array.array xs: Longitudes of the points, in input order
+    :ivar array.array ys: Latitudes of the points, in input order
+    :ivar array.array order: Point indices, sorted by cell
+    :ivar dict cells: Maps the key (see ``cell_key``) of each occupied cell to
+       a ``(start, end)`` slice of ``order``
+    """
+
+    def __init__(self, points, grid=None, per_cell=16, *args, **kwargs):
+        """
+        :param points: Iterable of (latitude, longitude) pairs.  It's only
+           iterated over once.
+        :param GridIndex grid: *(optional)* Grid by which to partition the
+           points.  By default one is chosen with ``default_cell_size``.
+        :param int per_cell: *(optional)* Average number of points per cell
+           aimed for when choosing a grid
+        """
+        xs = self.xs = array('d')
+        ys = self.ys = array('d')
+
+        for lat, lng in points:
+            xs.append(float(lng))
+            ys.append(float(lat))
+
+        if grid is None:
+            if xs:
+                bbox = (min(xs), min(ys), max(xs), max(ys))
+                grid = GridIndex(default_cell_size(bbox, len(xs), per_cell),
+                    bbox[0], bbox[1])
+            else:
+                grid = GridIndex(1.0)
+
+        self.grid = grid
+
+        # Range of occupied columns and rows, for packing cells into keys
+        if xs:
+            self.min_i, self.min_j = grid.cell_of(min(xs), min(ys))
+            self.max_i, self.max_j = grid.cell_of(max(xs), max(ys))
+        else:
+            self.min_i = self.min_j = 0
+            self.max_i = self.max_j = -1
+
+        # Cell key of each point, computed inline rather than through
+        # cell_of since this runs once per point
+        rows = self.max_j - self.min_j + 1
+        size = grid.cell_size
+        origin_x = grid.origin_x
+        origin_y = grid.origin_y
+        offset = self.min_i * rows + self.min_j
+        floor = math.floor
+        keys = array('l')
+        append = keys.append
+        for x, y in itertools.izip(xs, ys):
+            append(int(floor((x - origin_x) / size)) * rows +
+                int(floor((y - origin_y) / size)) - offset)
+
+        self.order, self.cells = _counting_sort(keys,
+            (self.max_i - self.min_i + 1) * rows)
+
+        super(PointGrid, self).__init__(*args, **kwargs)
+
+    def __len__(self):
+        return len(self.xs)
+
+    def cell_key(self, i, j):
+        """
+        :returns: Integer key of the cell in column ``i`` and row ``j``
+        :rtype: int
+        """
+        return (i - self.min_i) * (self.max_j - self.min_j + 1) + \
+            (j - self.min_j)
+
+    def _cell_keys(self, bbox):
+        # Keys of the occupied cells overlapping the bounding box.  The box is
+        # clipped to the cells the points occupy, and if that still leaves
+        # more cells than are occupied, the occupied ones are filtered instead.
+        min_i, min_j = self.grid.cell_of(bbox[0], bbox[1])
+        max_i, max_j = self.grid.cell_of(bbox[2], bbox[3])
+        min_i = max(min_i, self.min_i)
+        min_j = max(min_j, self.min_j)
+        max_i = min(max_i, self.max_i)
+        max_j = min(max_j, self.max_j)
+
+        if min_i > max_i or min_j > max_j:
+            return []
+
+        if (max_i - min_i + 1) * (max_j - min_j + 1) > len(self.cells):
+            rows = self.max_j - self.min_j + 1
+            keys = []
+            for key in self.cells:
+                i = key // rows + self.min_i
+                j = key % rows + self.min_j
+                if min_i <= i <= max_i and min_j <= j <= max_j:
+                    keys.append(key)
+            return keys
+
+        cell_key = self.cell_key
+        return [cell_key(i, j) for i in xrange(min_i, max_i + 1)
+            for j in xrange(min_j, max_j + 1)]
+
+    def candidates(self, bbox):
+        """
+        :param tuple bbox: Bounding box, as (min_x, min_y, max_x, max_y)
+        :returns: Indices of the points in cells overlapping the bounding box
+        :rtype: generator of ints
+        """
+        order = self.order
+        for key in self._cell_keys(bbox):
+            span = self.cells.get(key)
+            if span is None:
+                continue
+
+            for position in xrange(span[0], span[1]):
+                yield order[position]
+
+    def within(self, shape):
+        """
+        :param shape: Any object with a ``bbox`` attribute and a
+           ``contains(x, y)`` method (e.g. ``geometry.MultiPolygon``)
+        :returns: Sorted indices of the points inside the shape
+        :rtype: array.array
+        """
+        xs = self.xs
+        ys = self.ys
+        contains = shape.contains
+        return array('l', sorted(index for index in self.candidates(shape.bbox)
+            if contains(xs[index], ys[index])))
+
+    def count_within(self, shape):
+        """
+        :param shape: Same as for ``within``
+        :returns: Number of points inside the shape
+        :rtype: int
+        """
+        xs = self.xs
+        ys = self.ys
+        contains = shape.contains
+        return sum(1 for index in self.candidates(shape.bbox)
+            if contains(xs[index], ys[index]))
+
+
+def _counting_sort(keys, key_count):
+    # Sorts point indices by cell key in linear time, without creating any
+    # per-point objects.  Returns the sorted indices and a dict mapping each
+    # occupied key to its (start, end) slice of them.
+    if key_count > 2 * len(keys) + 1024:
+        # Far more cells than points (a cell size much smaller than the
+        # spread of the points): number the occupied cells instead
+        occupied = sorted(set(keys))
+        slot_of = dict((key, slot) for slot, key in enumerate(occupied))
+        slots = array('l', (slot_of[key] for key in keys))
+    else:
+        occupied = None
+        slots = keys
+
+    slot_count = len(occupied) if occupied is not None else key_count
+    starts = array('l', [0]) * (slot_count + 1)
+    for slot in slots:
+        starts[slot + 1] += 1
+
+    cells = {}
+    for slot in xrange(slot_count):
+        count = starts[slot + 1]
+        starts[slot + 1] += starts[slot]
+        if count:
+            key = occupied[slot] if occupied is not None else slot
+            cells[key] = (starts[slot], starts[slot + 1])
+
+    order = array('l', [0]) * len(slots)
+    for index, slot in enumerate(slots):
+        order[starts[slot]] = index
+        starts[slot] += 1
+
+    return order, cells
+
+
+def default_cell_size(bbox, count, per_cell=16):
+    """
+    Picks a cell size that puts roughly ``per_cell`` points in each cell if
+    the points were spread evenly over the bounding box.
+
+    :param tuple bbox: Bounding box of the points, as
+       (min_x, min_y, max_x, max_y)
+    :param int count: Number of points
+    :rtype: float
+    """
+    extent = max(bbox[2] - bbox[0], bbox[3] - bbox[1])
+    cells_per_side = max(1, int(math.sqrt(count / float(per_cell))))
+    return max(extent / cells_per_side, 1e-9)
+
+
+# Point grid being joined.  Kept at module level so that forked workers
+# inherit it rather than having it pickled to each of them.
+_worker_points = None
+
+def _join_task(task):
+    # Workers only send counts back unless the indices were asked for
+    level, district, boundary, groups = task
+    if groups:
+        return level, district, _worker_points.within(boundary)
+    return level, district, _worker_points.count_within(boundary)
+
+
+def spatial_join(points, boundaries, levels=None, groups=False,
+    cell_size=None, processes=1):
+    """
+    Assigns each point to the districts that contain it, and aggregates the
+    results by district.
+
+    Points are bucketed and sorted by grid cell once; each district boundary
+    is then tested only against the points in the cells its bounding box
+    covers.
+
+    :param points: Iterable of (latitude, longitude) pairs.  It's only
+       iterated over once, so it can be a generator.
+    :param dict boundaries: Boundaries indexed by electoral level, with each
+       item a list of ``(District, MultiPolygon)`` pairs -- as returned by
+       ``DistrictApi.get_boundaries``
+    :param list levels: *(optional)* Electoral levels to join against.
+       Defaults to all levels in ``boundaries``.
+    :param bool groups: *(optional)* If True, return the indices of the points
+       in each district instead of just counting them
+    :param float cell_size: *(optional)* Grid cell size in degrees.  By
+       default it's chosen from the number and spread of the points.
+    :param int processes: *(optional)* Number of worker processes to spread
+       districts across.  Pass None to use every core.  Defaults to 1.
+    :returns: Dictionary indexed by electoral level, with each item a dict
+       mapping each District to a count of points, or to an array of point
+       indices if ``groups`` is True
+    :rtype: dict
+    """
+    global _worker_points
+
+    if levels is None:
+        levels = boundaries.keys()
+
+    results = dict((level, {}) for level in levels)
+
+    point_grid = PointGrid(points, GridIndex(cell_size) if cell_size else None)
+    tasks = [(level, district, boundary, groups) for level in levels
+        for district, boundary in boundaries.get(level, [])]
+
+    # Workers inherit the point grid when the pool forks
+    _worker_points = point_grid
+    try:
+        if processes == 1:
+            joined = map(_join_task, tasks)
+        else:
+            import multiprocessing
+
+            pool = multiprocessing.Pool(processes)
+            try:
+                joined = pool.map(_join_task, tasks)
+            finally:
+                pool.close()
+                pool.join()
+    finally:
+        _worker_points = None
+
+    for level, district, found in joined:
+        results[level][district] = found
+
+    return results
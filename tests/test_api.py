@@ -6,7 +6,7 @@ from mock import patch, Mock
 from district_api.api import DistrictApi, District
 from district_api.exceptions import DistrictApiError, ApiUnavailable, \
     LocationUnavailable, AuthorizationError, QuotaExceeded, BadRequest, \
-    InvalidResponse
+    InvalidResponse, NotModified
 
 class ApiTestCase(TestCase):
     maxDiff = None
@@ -190,12 +190,21 @@ class ApiTestCase(TestCase):
                 'lat': 12.3456,
                 'lng': -10.432, 
                 'api-key': self.api_key,
-            })
+            }, headers={'Accept-Encoding': 'gzip, deflate'})
             
         self.client.send_request()
         self.assertTrue(get.called)
         get.assert_called_with(self.url, params={
                 'api-key': self.api_key,
+            }, headers={'Accept-Encoding': 'gzip, deflate'})
+            
+        self.client.send_request(validators={'etag': '"abc"', 
+            'last_modified': None})
+        get.assert_called_with(self.url, params={
+                'api-key': self.api_key,
+            }, headers={
+                'Accept-Encoding': 'gzip, deflate',
+                'If-None-Match': '"abc"',
             })
             
     def test_validate_status(self):
@@ -305,4 +314,59 @@ class ApiTestCase(TestCase):
         
         districts = self.client.get_all_districts()
             
-        self.assertEqual(districts, self.all_dist_success_data)
\ No newline at end of file
+        self.assertEqual(districts, self.all_dist_success_data)
+        
+    @patch('requests.get')
+    def test_conditional_requests(self, get):
+        mock_resp = Mock()
+        mock_resp.status_code = 200
+        mock_resp.headers = {'ETag': '"v1"', 
+            'Last-Modified': 'Tue, 01 Sep 2015 00:00:00 GMT'}
+        mock_resp.json.return_value = self.all_dist_success_dict
+        get.return_value = mock_resp
+        
+        catalog = self.client.get_district_catalog()
+        self.assertNotIn('If-None-Match', get.call_args[1]['headers'])
+        
+        # Unchanged: nothing is parsed, and the same catalog comes back
+        not_modified = Mock()
+        not_modified.status_code = 304
+        get.return_value = not_modified
+        
+        self.assertIs(self.client.get_district_catalog(), catalog)
+        self.assertEqual(get.call_args[1]['headers'], {
+            'Accept-Encoding': 'gzip, deflate',
+            'If-None-Match': '"v1"',
+            'If-Modified-Since': 'Tue, 01 Sep 2015 00:00:00 GMT',
+        })
+        self.assertFalse(not_modified.json.called)
+        
+        districts = self.client.get_all_districts()
+        self.assertEqual(districts, self.all_dist_success_data)
+        districts[sorted(districts)[0]].pop()
+        self.assertEqual(self.client.get_all_districts(), 
+            self.all_dist_success_data)
+        
+        # Changed
+        mock_resp.headers = {'ETag': '"v2"'}
+        get.return_value = mock_resp
+        self.assertIsNot(self.client.get_district_catalog(), catalog)
+        
+        get.return_value = not_modified
+        self.client.get_all_districts()
+        self.assertEqual(get.call_args[1]['headers']['If-None-Match'], 
+            '"v2"')
+        
+        # Changed, without validators: the next request is unconditional
+        mock_resp.headers = {}
+        get.return_value = mock_resp
+        self.client.get_all_districts()
+        self.client.get_all_districts()
+        self.assertNotIn('If-None-Match', get.call_args[1]['headers'])
+        self.assertNotIn('If-Modified-Since', get.call_args[1]['headers'])
+        
+        get.return_value = not_modified
+        
+        # A 304 with nothing to fall back on
+        with self.assertRaises(NotModified):
+            DistrictApi('dummy').get_all_districts()
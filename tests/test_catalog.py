@@ -0,0 +1,151 @@
+from unittest import TestCase
+from mock import patch, Mock
+
+from district_api.api import DistrictApi, District
+from district_api.catalog import DistrictCatalog, CatalogFeed, normalize_name
+
+import test_api
+
+all_dist_success_dict = test_api.ApiTestCase.all_dist_success_dict
+all_dist_success_data = test_api.ApiTestCase.all_dist_success_data
+
+class CatalogTestCase(TestCase):
+
+    def setUp(self):
+        client = DistrictApi('dummy')
+        districts = client.construct_all_locations_data({
+            "results": all_dist_success_dict['results'] + [
+                {
+                    "district": "Upper  West Side",
+                    "level": "Neighborhood",
+                    "kml_url": None,
+                },
+                {
+                    "district": "24",
+                    "level": "City Council",
+                    "kml_url": "http://example.com/24.xml",
+                },
+            ],
+            "status": "OK",
+        })
+        self.catalog = DistrictCatalog(districts)
+
+    def test_normalize_name(self):
+        self.assertEqual(normalize_name(' Upper   West\tSide '),
+            'upper west side')
+        self.assertEqual(normalize_name('007'), '7')
+        self.assertEqual(normalize_name('00'), '0')
+
+    def test_container(self):
+        self.assertEqual(len(self.catalog), 9)
+        self.assertEqual(sorted(self.catalog), sorted(self.catalog.levels()))
+        self.assertTrue('City Council' in self.catalog)
+        self.assertEqual([d.district for d in self.catalog['City Council']],
+            ['07', '10', '24'])
+
+    def test_get(self):
+        self.assertEqual(self.catalog.get('City Council', '07'),
+            District('07', 'City Council',
+                'http://graphics8.nytimes.com/packages/xml/represent/1513.xml'))
+        self.assertEqual(self.catalog.get('City Council', '7'), None)
+        self.assertEqual(self.catalog.get('State Senate', '07', 'x'), 'x')
+
+    def test_by_kml_url(self):
+        district = self.catalog.by_kml_url(
+            'http://graphics8.nytimes.com/packages/xml/represent/1311.xml')
+        self.assertEqual((district.level, district.district),
+            ('U.S. House', '10'))
+        self.assertEqual(self.catalog.by_kml_url(None), None)
+
+    def test_find(self):
+        self.assertEqual(self.catalog.find('7', 'City Council').district, '07')
+        self.assertEqual(self.catalog.find('upper west side',
+            'Neighborhood').district, 'Upper  West Side')
+        self.assertEqual(self.catalog.find('7', 'U.S. House'), None)
+        self.assertEqual(sorted((d.level, d.district) for d in
+            self.catalog.find('10')), [('City Council', '10'),
+            ('U.S. House', '10')])
+        self.assertEqual(self.catalog.find('nowhere'), [])
+
+    def test_range(self):
+        self.assertEqual([d.district for d in
+            self.catalog.range('City Council', 8, 24)], ['10', '24'])
+        self.assertEqual([d.district for d in
+            self.catalog.range('City Council', high=10)], ['07', '10'])
+        self.assertEqual([d.district for d in
+            self.catalog.range('City Council')], ['07', '10', '24'])
+        self.assertEqual(self.catalog.range('Neighborhood'), [])
+        self.assertEqual(self.catalog.range('Nowhere', 1, 2), [])
+
+    def test_prefix(self):
+        self.assertEqual([d.district for d in
+            self.catalog.prefix('Neighborhood', 'WEST')],
+            ['West Brighton', 'Westerleigh'])
+        self.assertEqual([d.district for d in
+            self.catalog.prefix('Neighborhood', 'upper  w')],
+            ['Upper  West Side'])
+        self.assertEqual(self.catalog.prefix('Neighborhood', 'z'), [])
+
+    @patch('requests.get')
+    def test_client_catalog(self, get):
+        mock_resp = Mock()
+        mock_resp.status_code = 200
+        mock_resp.json.return_value = all_dist_success_dict
+        get.return_value = mock_resp
+
+        catalog = DistrictApi('dummy').get_district_catalog()
+        self.assertEqual(catalog.districts,
+            all_dist_success_data)
+
+    def test_diff(self):
+        districts = dict((level, list(self.catalog[level]))
+            for level in self.catalog)
+        districts['City Council'] = [
+            District('07', 'City Council', 'http://example.com/new.xml'),
+            District('10', 'City Council',
+                'http://graphics8.nytimes.com/packages/xml/represent/1516.xml'),
+        ]
+        districts['State Senate'] = [
+            District('24', 'State Senate', 'http://example.com/24.xml')]
+        diff = self.catalog.diff(DistrictCatalog(districts))
+
+        self.assertEqual(diff.added, districts['State Senate'])
+        self.assertEqual(diff.removed, [District('24', 'City Council',
+            'http://example.com/24.xml')])
+        self.assertEqual(diff.changed, [(self.catalog.get('City Council', '07'),
+            districts['City Council'][0])])
+        self.assertEqual(diff.levels(), set(['City Council', 'State Senate']))
+        self.assertEqual(diff.stale_kml_urls(), set([
+            'http://example.com/24.xml',
+            'http://graphics8.nytimes.com/packages/xml/represent/1513.xml']))
+        self.assertEqual(diff.new_kml_urls(), set([
+            'http://example.com/new.xml', 'http://example.com/24.xml']))
+        self.assertEqual(len(diff), 3)
+
+        self.assertFalse(self.catalog.diff(DistrictCatalog(
+            self.catalog.districts)))
+
+    def test_feed(self):
+        client = Mock()
+        client.get_district_catalog.return_value = self.catalog
+        notifications = []
+
+        feed = CatalogFeed(client)
+        feed.subscribe(lambda diff, catalog: notifications.append(
+            (diff, catalog)))
+
+        diff = feed.refresh()
+        self.assertEqual(len(diff.added), 9)
+        self.assertEqual(notifications, [(diff, self.catalog)])
+        self.assertTrue(feed.catalog is self.catalog)
+
+        # nothing changed, so subscribers aren't bothered
+        self.assertFalse(feed.refresh())
+        self.assertEqual(len(notifications), 1)
+
+        smaller = DistrictCatalog({
+            'City Council': self.catalog['City Council'], })
+        diff = feed.refresh(smaller)
+        self.assertEqual(len(diff.removed), 6)
+        self.assertEqual(notifications[-1], (diff, smaller))
+        self.assertEqual(client.get_district_catalog.call_count, 2)
@@ -0,0 +1,102 @@
+import pickle
+from unittest import TestCase
+from mock import patch, Mock
+
+from district_api.api import DistrictApi
+from district_api.exceptions import DistrictApiError, ApiUnavailable, \
+    LocationUnavailable, InvalidResponse, QuotaExceeded, excerpt, \
+    count_errors, EXCERPT_LENGTH
+
+class ExceptionsTestCase(TestCase):
+
+    def response(self, status_code=500, text='x' * 1000):
+        response = Mock()
+        response.status_code = status_code
+        response.text = text
+        return response
+
+    def test_excerpt(self):
+        self.assertEqual(excerpt('short'), 'short')
+        self.assertEqual(excerpt('abcdef', 3), 'abc...')
+        self.assertEqual(excerpt({'status': None}), "{'status': None}")
+        self.assertEqual(len(excerpt('x' * 1000)), EXCERPT_LENGTH + 3)
+
+    def test_from_response(self):
+        response = self.response()
+        error = ApiUnavailable.from_response(response, lat_lng=(1.0, 2.0))
+
+        self.assertEqual(error.status_code, 500)
+        self.assertEqual(error.message, 'HTTP 500')
+        self.assertEqual(error.excerpt, 'x' * EXCERPT_LENGTH + '...')
+        self.assertEqual(error.lat_lng, (1.0, 2.0))
+        self.assertEqual(error.response, None)
+        self.assertEqual(error.kind, ('ApiUnavailable', 500))
+        self.assertIn('HTTP 500 lat_lng=(1.0, 2.0)', str(error))
+
+        error = ApiUnavailable.from_response(response, keep_response=True)
+        self.assertIs(error.response, response)
+
+        # bodies that can't be read are left out
+        response = Mock(spec=['status_code'])
+        response.status_code = 404
+        self.assertEqual(DistrictApiError.from_response(response).excerpt,
+            None)
+
+    def test_pickle(self):
+        error = LocationUnavailable('Response status is ERROR',
+            errors=['out of range'], lat_lng=(1.0, 2.0),
+            response=self.response())
+        copy = pickle.loads(pickle.dumps(error))
+
+        self.assertEqual(type(copy), LocationUnavailable)
+        self.assertEqual(copy.errors, ['out of range'])
+        self.assertEqual(copy.lat_lng, (1.0, 2.0))
+        self.assertEqual(copy.response, None)
+        self.assertEqual(str(copy), str(error))
+
+        # plain messages still work as before
+        self.assertEqual(str(QuotaExceeded('No API key has quota remaining')),
+            'No API key has quota remaining')
+        self.assertEqual(str(LocationUnavailable()), '')
+
+    def test_count_errors(self):
+        errors = [ApiUnavailable(status_code=500),
+            ApiUnavailable(status_code=500), ApiUnavailable(status_code=404),
+            LocationUnavailable(), ValueError()]
+
+        self.assertEqual(count_errors(errors), {
+            ('ApiUnavailable', 500): 2,
+            ('ApiUnavailable', 404): 1,
+            ('LocationUnavailable', None): 1,
+            ('ValueError', None): 1,
+        })
+
+    @patch('requests.get')
+    def test_client_errors(self, get):
+        get.return_value = self.response()
+
+        with self.assertRaises(ApiUnavailable) as cm:
+            DistrictApi('dummy').get_districts((1, 2))
+        self.assertEqual(cm.exception.lat_lng, (1.0, 2.0))
+        self.assertEqual(cm.exception.response, None)
+
+        with self.assertRaises(ApiUnavailable) as cm:
+            DistrictApi('dummy', keep_responses=True).get_all_districts()
+        self.assertEqual(cm.exception.lat_lng, None)
+        self.assertIs(cm.exception.response, get.return_value)
+
+        response = self.response(200, '<html>')
+        response.json.side_effect = ValueError
+        get.return_value = response
+        with self.assertRaises(InvalidResponse) as cm:
+            DistrictApi('dummy').get_districts((1, 2))
+        self.assertEqual(cm.exception.excerpt, '<html>')
+
+        response = self.response(200)
+        response.json.return_value = {'status': 'ERROR',
+            'errors': ['out of range']}
+        get.return_value = response
+        with self.assertRaises(LocationUnavailable) as cm:
+            DistrictApi('dummy').get_districts((1, 2))
+        self.assertEqual(cm.exception.errors, ['out of range'])
+        self.assertEqual(cm.exception.kind, ('LocationUnavailable', None))
@@ -0,0 +1,135 @@
+from unittest import TestCase, skipIf
+from mock import patch, Mock
+
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+from district_api.api import DistrictApi, District
+from district_api.catalog import DistrictCatalog
+from district_api.exceptions import LocationUnavailable
+from district_api.frames import annotate_frame, annotate_batches
+
+from test_shared import boundaries, council_1, council_2, senate_24
+
+def lookup(lat_lng):
+    # districts by latitude band
+    lat, lng = lat_lng
+    if lat < 0:
+        raise LocationUnavailable()
+    if lat < 10:
+        return {'City Council': council_1, 'State Senate': senate_24}
+    return {'City Council': council_2}
+
+@skipIf(pandas is None, 'pandas is not installed')
+class FramesTestCase(TestCase):
+
+    def frame(self):
+        return pandas.DataFrame({
+            'lat': [5.0, 15.0, 5.0, -5.0, None, 15.0],
+            'lng': [5.0, 5.0, 5.0, 5.0, 5.0, 5.0],
+            'name': ['a', 'b', 'c', 'd', 'e', 'f'],
+        })
+
+    def test_annotate(self):
+        calls = []
+        def counting_lookup(lat_lng):
+            calls.append(lat_lng)
+            return lookup(lat_lng)
+
+        df = self.frame()
+        annotated = annotate_frame(df, counting_lookup)
+
+        # each distinct location is only looked up once
+        self.assertEqual(sorted(calls), [(-5.0, 5.0), (5.0, 5.0),
+            (15.0, 5.0)])
+        self.assertEqual(list(df.columns), ['lat', 'lng', 'name'])
+
+        council = annotated['City Council district']
+        self.assertEqual(str(council.dtype), 'category')
+        self.assertEqual(list(council.astype(object).where(council.notnull(),
+            None)), ['1', '2', '1', None, None, '2'])
+        self.assertEqual(list(annotated['State Senate kml_url'].isnull()),
+            [False, True, False, True, True, True])
+        self.assertEqual(annotated['State Senate kml_url'][0],
+            'http://example.com/24.xml')
+
+    def test_levels_and_catalog(self):
+        catalog = DistrictCatalog({
+            'City Council': [council_1, council_2,
+                District('3', 'City Council', None)], })
+        annotated = annotate_frame(self.frame(), lookup,
+            levels=['City Council'], catalog=catalog)
+
+        self.assertEqual(list(annotated.columns), ['lat', 'lng', 'name',
+            'City Council district', 'City Council kml_url'])
+        categories = annotated['City Council district'].cat.categories
+        self.assertEqual(list(categories), ['1', '2', '3'])
+
+    def test_resolvers(self):
+        expected = annotate_frame(self.frame(), lookup)
+        frame = pandas.DataFrame({'lat': [5.0, 2.0], 'lng': [5.0, 12.0]})
+
+        # boundaries dict, resolved by spatial join
+        annotated = annotate_frame(frame, boundaries)
+        self.assertEqual(list(annotated['City Council district']), ['1', '2'])
+
+        # every row at the same location
+        frame = pandas.DataFrame({'lat': [5.0, 5.0], 'lng': [5.0, 5.0]})
+        annotated = annotate_frame(frame, boundaries)
+        self.assertEqual(list(annotated['City Council district']), ['1', '1'])
+
+        # object with a locate method
+        index = Mock(spec=['locate'])
+        index.locate.side_effect = lookup
+        annotated = annotate_frame(self.frame(), index)
+        self.assertTrue(annotated.equals(expected))
+
+    def test_batches(self):
+        df = self.frame()
+        calls = []
+        def counting_lookup(lat_lng):
+            calls.append(lat_lng)
+            return lookup(lat_lng)
+
+        batch = Mock(spec=['to_pandas'])
+        batch.to_pandas.return_value = df[3:]
+        batches = list(annotate_batches([df[:3], batch], counting_lookup))
+
+        self.assertEqual(len(batches), 2)
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(list(batches[1]['City Council district'].isnull()),
+            [True, True, False])
+
+        # with a catalog, every batch gets the catalog's levels, whichever
+        # levels its own locations fall in
+        catalog = DistrictCatalog({'City Council': [council_1, council_2],
+            'State Senate': [senate_24]})
+        batches = list(annotate_batches([df[1:2], df[:1]], lookup,
+            catalog=catalog))
+        self.assertEqual(list(batches[0].columns), list(batches[1].columns))
+        self.assertEqual(list(batches[0].columns)[3:], [
+            'City Council district', 'City Council kml_url',
+            'State Senate district', 'State Senate kml_url'])
+        self.assertTrue(batches[0]['State Senate district'].isnull().all())
+
+    @patch('requests.get')
+    def test_client_annotate(self, get):
+        mock_resp = Mock()
+        mock_resp.status_code = 200
+        mock_resp.json.return_value = {
+            "results": [{
+                "district": "31",
+                "level": "State Senate",
+                "kml_url": None,
+            }],
+            "status": "OK",
+        }
+        get.return_value = mock_resp
+
+        annotated = DistrictApi('dummy').annotate_frame(self.frame()[:3])
+        self.assertEqual(get.call_count, 2)
+        self.assertEqual(list(annotated['State Senate district']),
+            ['31', '31', '31'])
+        self.assertTrue(annotated['State Senate kml_url'].isnull().all())
@@ -0,0 +1,152 @@
+import math
+from io import BytesIO
+from unittest import TestCase
+from mock import patch
+
+from district_api import geometry
+from district_api.geometry import Polygon, MultiPolygon, ring_contains, \
+    ring_area, simplify_ring, parse_kml, read_kml, iter_kml_polygons
+
+SQUARE = [0, 0, 10, 0, 10, 10, 0, 10, 0, 0]
+HOLE = [4, 4, 6, 4, 6, 6, 4, 6, 4, 4]
+
+KML = """<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2">
+  <Document>
+    <Placemark>
+      <name>Test district</name>
+      <MultiGeometry>
+        <Polygon>
+          <outerBoundaryIs><LinearRing><coordinates>
+            0,0,0 10,0,0 10,10,0 0,10,0 0,0,0
+          </coordinates></LinearRing></outerBoundaryIs>
+          <innerBoundaryIs><LinearRing><coordinates>
+            4,4 6,4 6,6 4,6 4,4
+          </coordinates></LinearRing></innerBoundaryIs>
+        </Polygon>
+        <Polygon>
+          <outerBoundaryIs><LinearRing><coordinates>
+            20,20 30,20 30,30 20,20
+          </coordinates></LinearRing></outerBoundaryIs>
+        </Polygon>
+      </MultiGeometry>
+    </Placemark>
+  </Document>
+</kml>
+"""
+
+class GeometryTestCase(TestCase):
+
+    def test_ring_contains(self):
+        self.assertTrue(ring_contains(SQUARE, 5, 5))
+        self.assertTrue(ring_contains(SQUARE[:-2], 5, 5))
+        self.assertFalse(ring_contains(SQUARE, 11, 5))
+        self.assertFalse(ring_contains(SQUARE, 5, -1))
+
+    def test_polygon(self):
+        polygon = Polygon([SQUARE, HOLE])
+        self.assertEqual(polygon.bbox, (0, 0, 10, 10))
+        self.assertTrue(polygon.contains(1, 1))
+        self.assertFalse(polygon.contains(5, 5))
+        self.assertFalse(polygon.contains(15, 5))
+
+        with self.assertRaises(ValueError):
+            Polygon([[0, 0, 1, 1]])
+
+    def test_multipolygon(self):
+        shape = MultiPolygon([Polygon([SQUARE]),
+            Polygon([[20, 20, 30, 20, 30, 30]])])
+        self.assertEqual(shape.bbox, (0, 0, 30, 30))
+        self.assertTrue(shape.contains(5, 5))
+        self.assertTrue(shape.contains(29, 21))
+        self.assertFalse(shape.contains(15, 15))
+
+        with self.assertRaises(ValueError):
+            MultiPolygon([])
+
+    def test_parse_kml(self):
+        shape = parse_kml(KML)
+        self.assertEqual(len(shape.polygons), 2)
+        self.assertEqual(len(shape.polygons[0].rings), 2)
+        self.assertEqual(list(shape.polygons[0].rings[0]), SQUARE)
+        self.assertTrue(shape.contains(1, 1))
+        self.assertFalse(shape.contains(5, 5))
+
+        with self.assertRaises(ValueError):
+            parse_kml('<kml><Document /></kml>')
+
+    def test_area(self):
+        self.assertEqual(ring_area(SQUARE), 100)
+        self.assertEqual(ring_area(SQUARE[:-2]), 100)
+        self.assertEqual(Polygon([SQUARE, HOLE]).areas, [100, 4])
+        self.assertEqual(parse_kml(KML).area, 96 + 50)
+
+    def test_simplify_ring(self):
+        # a square with an extra vertex in the middle of each side, one of
+        # which is pushed slightly outwards
+        ring = [0, 0, 5, 0, 10, 0, 10, 5, 10, 10, 5, 10.05, 0, 10, 0, 5, 0, 0]
+        simplified = simplify_ring(ring, 0.1)
+        self.assertEqual(list(simplified), SQUARE)
+
+        # the bump survives a tighter tolerance
+        self.assertEqual(len(simplify_ring(ring, 0.01)), 12)
+
+        # rings smaller than the tolerance collapse
+        self.assertEqual(simplify_ring(HOLE, 5), None)
+        self.assertEqual(simplify_ring([0, 0, 1, 1], 0), None)
+
+    def test_simplify_error_bound(self):
+        # a finely sampled circle of radius 1
+        ring = []
+        for i in range(1000):
+            angle = 2 * math.pi * i / 1000
+            ring.extend((math.cos(angle), math.sin(angle)))
+
+        tolerance = 0.01
+        polygon = Polygon([ring])
+        simplified = polygon.simplify(tolerance)
+        self.assertTrue(simplified.vertex_count() < 50)
+
+        # away from the edge, containment is unaffected
+        for i in range(200):
+            angle = 2 * math.pi * i / 200
+            for radius in (1 - 2 * tolerance, 1 + 2 * tolerance, 0.5):
+                x = radius * math.cos(angle)
+                y = radius * math.sin(angle)
+                self.assertEqual(simplified.contains(x, y),
+                    polygon.contains(x, y))
+
+    def test_streaming(self):
+        polygons = list(iter_kml_polygons(BytesIO(KML)))
+        self.assertEqual(len(polygons), 2)
+        self.assertEqual(polygons[1].bbox, (20, 20, 30, 30))
+
+        # the hole collapses at this tolerance, but the outer rings don't
+        shape = read_kml(BytesIO(KML), tolerance=3)
+        self.assertEqual([len(p.rings) for p in shape.polygons], [1, 1])
+        self.assertTrue(shape.contains(5, 5))
+
+        with self.assertRaises(SyntaxError):
+            read_kml(BytesIO('<kml><Polygon>'))
+
+    def test_streaming_detaches_elements(self):
+        placemark = KML[KML.index('<Placemark>'):KML.index('</Document>')]
+        kml = KML.replace(placemark, placemark * 50)
+
+        elements = []
+        iterparse = geometry.ElementTree.iterparse
+        def recording_iterparse(*args, **kwargs):
+            for event, element in iterparse(*args, **kwargs):
+                elements.append(element)
+                yield event, element
+
+        with patch('%s.iterparse' % geometry.ElementTree.__name__,
+            recording_iterparse):
+            polygons = list(iter_kml_polygons(BytesIO(kml)))
+
+        # placemarks that have been read aren't left behind, emptied, in
+        # <Document>
+        self.assertEqual(len(polygons), 100)
+        self.assertEqual(elements[1].tag,
+            '{http://www.opengis.net/kml/2.2}Document')
+        self.assertEqual(len(elements[1]), 0)
@@ -0,0 +1,156 @@
+import time
+import threading
+from unittest import TestCase
+from mock import patch, Mock
+
+from district_api.api import DistrictApi
+from district_api.hedging import HedgePolicy
+
+class HedgePolicyTestCase(TestCase):
+
+    def warmed_policy(self, latency=0.01, **kwargs):
+        policy = HedgePolicy(min_samples=10, **kwargs)
+        for i in range(10):
+            policy.record(latency)
+        return policy
+
+    def test_delay(self):
+        policy = HedgePolicy(percentile=50, min_samples=3)
+        self.assertEqual(policy.delay(), None)
+
+        for latency in (0.3, 0.1, 0.2):
+            policy.record(latency)
+        self.assertEqual(policy.delay(), 0.2)
+
+        policy.min_delay = 0.5
+        self.assertEqual(policy.delay(), 0.5)
+
+        with self.assertRaises(ValueError):
+            HedgePolicy(percentile=0)
+
+    def test_fast_call_not_hedged(self):
+        policy = self.warmed_policy(latency=1.0, max_extra_load=1)
+        func = Mock(return_value='result')
+
+        self.assertEqual(policy.call(func, 'a', b='c'), 'result')
+        func.assert_called_once_with('a', b='c')
+        self.assertEqual(policy.stats(), {
+            'requests': 1, 'hedges_fired': 0, 'hedges_won': 0, })
+
+    def test_slow_call_hedged(self):
+        policy = self.warmed_policy(max_extra_load=1)
+        release = threading.Event()
+        calls = []
+
+        def func():
+            calls.append(1)
+            if len(calls) == 1:
+                # the original request hangs until the hedge has answered
+                release.wait(5)
+                return 'slow'
+            return 'fast'
+
+        self.assertEqual(policy.call(func), 'fast')
+        release.set()
+        self.assertEqual(policy.stats(), {
+            'requests': 1, 'hedges_fired': 1, 'hedges_won': 1, })
+
+    def test_loser_recorded_and_closed(self):
+        policy = self.warmed_policy(max_extra_load=1)
+        release = threading.Event()
+        slow = Mock()
+        hedges = []
+
+        def func():
+            if not hedges:
+                # the original request hangs until the hedge has answered
+                release.wait(5)
+                time.sleep(0.2)
+                return slow
+            return 'fast'
+
+        self.assertEqual(policy.run(func, on_hedge=lambda: hedges.append(1)),
+            'fast')
+        self.assertEqual(hedges, [1])
+        release.set()
+
+        for i in range(100):
+            if slow.close.called:
+                break
+            time.sleep(0.01)
+
+        # the slow original still counts towards the latency percentile
+        self.assertTrue(slow.close.called)
+        self.assertTrue(max(policy._latencies) >= 0.2)
+
+    def test_extra_load_cap(self):
+        policy = self.warmed_policy(percentile=50, max_extra_load=0.5)
+        func = Mock(side_effect=lambda: time.sleep(0.05) or 'result')
+
+        for i in range(4):
+            self.assertEqual(policy.call(func), 'result')
+
+        self.assertEqual(policy.hedges_fired, 2)
+        self.assertEqual(policy.requests, 4)
+
+    def test_extra_load_cap_concurrent(self):
+        policy = self.warmed_policy(max_extra_load=0.25)
+        calls = []
+
+        def func():
+            calls.append(1)
+            time.sleep(0.1)
+            return 'result'
+
+        # every call is slow, so they all reach the hedge decision at about
+        # the same time.  Checking the cap apart from counting the hedge
+        # would let them all through while the check dawdles.
+        allow_hedge = policy.allow_hedge
+        def slow_allow_hedge():
+            allowed = allow_hedge()
+            time.sleep(0.02)
+            return allowed
+
+        with patch.object(policy, 'allow_hedge', slow_allow_hedge):
+            threads = [threading.Thread(target=policy.call, args=(func,))
+                for i in range(20)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(5)
+
+        stats = policy.stats()
+        self.assertEqual(stats['requests'], 20)
+        self.assertTrue(0 < stats['hedges_fired'] <= 5)
+        self.assertEqual(len(calls), 20 + stats['hedges_fired'])
+
+    def test_errors(self):
+        policy = HedgePolicy()
+        with self.assertRaises(KeyError):
+            policy.call(Mock(side_effect=KeyError('a')))
+
+    @patch('requests.get')
+    def test_client_hedging(self, get):
+        mock_resp = Mock()
+        mock_resp.status_code = 200
+        mock_resp.json.return_value = {'status': 'OK', 'results': []}
+        get.return_value = mock_resp
+
+        client = DistrictApi('dummy', hedge_policy=True)
+        self.assertTrue(isinstance(client.hedge_policy, HedgePolicy))
+
+        self.assertEqual(client.send_request((40.7, -74.0)), mock_resp)
+        self.assertEqual(client.hedge_policy.requests, 1)
+
+        # hedges are counted against the key that sent them
+        client.hedge_policy = self.warmed_policy(latency=0.01,
+            max_extra_load=1)
+        get.side_effect = lambda *args, **kwargs: time.sleep(0.1) or mock_resp
+        client.get_data((40.7, -74.0))
+        self.assertEqual(client.hedge_policy.hedges_fired, 1)
+        self.assertEqual(client.key_pool.keys[0].day_count, 2)
+        get.side_effect = None
+
+        # all-districts requests aren't hedged
+        client.send_request()
+        self.assertEqual(client.hedge_policy.requests, 1)
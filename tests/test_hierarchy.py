@@ -0,0 +1,82 @@
+import random
+from unittest import TestCase
+
+from district_api.api import District
+from district_api.geometry import Polygon, MultiPolygon, \
+    segment_intersects_bbox
+from district_api.hierarchy import HierarchyIndex
+
+from test_shared import boundaries, council_1, council_2, senate_24
+
+def brute_force(boundaries, lat_lng):
+    found = {}
+    for level, districts in boundaries.items():
+        for district, boundary in districts:
+            if boundary.contains(lat_lng[1], lat_lng[0]):
+                found[level] = district
+                break
+    return found
+
+# A diagonal split of the area, so that boundaries aren't grid-aligned
+triangles = {
+    'Community District': [
+        (District('101', 'Community District', None),
+            MultiPolygon([Polygon([[0, 0, 20, 0, 0, 20]])])),
+        (District('102', 'Community District', None),
+            MultiPolygon([Polygon([[20, 0, 20, 20, 0, 20]])])),
+    ],
+}
+
+class HierarchyTestCase(TestCase):
+
+    def setUp(self):
+        self.boundaries = dict(boundaries)
+        self.boundaries.update(triangles)
+
+    def test_segment_intersects_bbox(self):
+        bbox = (0, 0, 10, 10)
+        self.assertTrue(segment_intersects_bbox(-5, 5, 15, 5, bbox))
+        self.assertTrue(segment_intersects_bbox(2, 2, 3, 3, bbox))
+        self.assertTrue(segment_intersects_bbox(-5, 5, 5, 15, bbox))
+        self.assertFalse(segment_intersects_bbox(-5, 11, 5, 21, bbox))
+        self.assertFalse(segment_intersects_bbox(11, 0, 11, 10, bbox))
+
+    def test_locate(self):
+        index = HierarchyIndex(self.boundaries)
+        self.assertEqual(index.locate((5, 5)), {
+            'City Council': council_1,
+            'Community District': triangles['Community District'][0][0],
+            'State Senate': senate_24,
+        })
+        self.assertEqual(index.locate((5, 15)), {
+            'Community District': triangles['Community District'][1][0],
+            'State Senate': senate_24,
+        })
+        self.assertEqual(index.locate((30.5, 30.5)), {
+            'City Council': council_2})
+        self.assertEqual(index.locate((25, 25)), {})
+        self.assertEqual(index.locate((-50, 100)), {})
+
+    def test_matches_per_level_tests(self):
+        random.seed(1)
+        points = [(random.uniform(-1, 32), random.uniform(-1, 32))
+            for i in range(1000)]
+
+        for cell_size, max_depth in ((None, 4), (0.7, 0), (100, 6)):
+            index = HierarchyIndex(self.boundaries, cell_size=cell_size,
+                max_depth=max_depth)
+            for point in points:
+                self.assertEqual(index.locate(point),
+                    brute_force(self.boundaries, point))
+
+    def test_stats(self):
+        shallow = HierarchyIndex(self.boundaries, max_depth=0).stats()
+        deep = HierarchyIndex(self.boundaries, max_depth=5).stats()
+
+        self.assertTrue(deep['atomic'] > shallow['atomic'])
+        self.assertTrue(deep['atomic'] > deep['boundary'])
+        # three districts per atomic cell at most, and few distinct sets
+        self.assertTrue(deep['district_sets'] <= 10)
+
+    def test_empty(self):
+        self.assertEqual(HierarchyIndex({}).locate((5, 5)), {})
@@ -0,0 +1,63 @@
+import os
+import sys
+import subprocess
+from unittest import TestCase
+
+from district_api.lazy import LazyModule, lazy_import
+
+# Seconds allowed for ``import district_api.api``, not counting interpreter
+# startup.  Override on slow machines with DISTRICT_API_IMPORT_BUDGET.
+IMPORT_BUDGET = float(os.environ.get('DISTRICT_API_IMPORT_BUDGET', 0.02))
+
+# Modules that must not be loaded until they're actually needed
+HEAVY_MODULES = ('requests', 'xml.etree.ElementTree', 'multiprocessing',
+    'mmap')
+
+IMPORT_SCRIPT = """
+import sys, time
+start = time.time()
+import district_api.api
+elapsed = time.time() - start
+loaded = [name for name in %r if name in sys.modules]
+print('%%f %%s' %% (elapsed, ','.join(loaded)))
+""" % (HEAVY_MODULES,)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def time_import():
+    # Measure with bytecode caching on, as in a deployed package
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+
+    output = subprocess.check_output([sys.executable, '-c', IMPORT_SCRIPT],
+        cwd=ROOT, env=env)
+    elapsed, loaded = output.decode('ascii').strip().partition(' ')[::2]
+    return float(elapsed), [name for name in loaded.split(',') if name]
+
+class ImportTimeTestCase(TestCase):
+
+    def test_heavy_modules_deferred(self):
+        elapsed, loaded = time_import()
+        self.assertEqual(loaded, [])
+
+    def test_import_time(self):
+        # The first run may have to write bytecode; take the best of the rest
+        time_import()
+        elapsed = min(time_import()[0] for i in range(5))
+        self.assertTrue(elapsed < IMPORT_BUDGET, 'import district_api.api '
+            'took %.1fms (budget %.1fms)' % (elapsed * 1000,
+            IMPORT_BUDGET * 1000))
+
+    def test_lazy_module(self):
+        self.assertTrue(lazy_import('sys') is sys)
+
+        module = lazy_import('district_api.tests_never_imported')
+        self.assertTrue(isinstance(module, LazyModule))
+        with self.assertRaises(ImportError):
+            module.anything
+
+        json = LazyModule('json')
+        self.assertEqual(json.dumps([1]), '[1]')
+
+        module = lazy_import('district_api.tests_never_imported', 'json')
+        self.assertEqual(module.dumps([1]), '[1]')
@@ -0,0 +1,146 @@
+import time
+from unittest import TestCase
+from mock import patch, Mock
+
+from district_api.api import DistrictApi
+from district_api.keys import ApiKey, KeyPool
+from district_api.exceptions import AuthorizationError, QuotaExceeded
+
+class KeyPoolTestCase(TestCase):
+    success_response_dict = {
+        "results": [],
+        "status": "OK",
+    }
+
+    def test_construction(self):
+        pool = KeyPool(['a', ApiKey('b', rate=5)], daily_budget=100)
+        self.assertEqual(len(pool), 2)
+        self.assertEqual(pool.keys[0].daily_budget, 100)
+        self.assertEqual(pool.keys[1].rate, 5)
+        self.assertEqual(pool.keys[1].daily_budget, None)
+
+        with self.assertRaises(ValueError):
+            KeyPool([])
+
+    def test_least_loaded(self):
+        pool = KeyPool(['a', 'b', 'c'], daily_budget=10)
+        used = [pool.acquire() for i in range(6)]
+        self.assertEqual(sorted(used), ['a', 'a', 'b', 'b', 'c', 'c'])
+
+        # select doesn't count against the quota
+        key = pool.select()
+        self.assertEqual(key, pool.select())
+
+    def test_budget_exhaustion(self):
+        pool = KeyPool(['a', 'b'], daily_budget=2)
+        for i in range(4):
+            pool.acquire()
+
+        self.assertEqual(pool.available_count(), 0)
+        with self.assertRaises(QuotaExceeded):
+            pool.acquire()
+
+    def test_rate_window(self):
+        pool = KeyPool(['a'], rate=1)
+        with patch('time.time', Mock(return_value=1000.0)):
+            pool.acquire()
+            with self.assertRaises(QuotaExceeded):
+                pool.acquire(block=False)
+
+        with patch('time.time', Mock(return_value=1001.5)):
+            self.assertEqual(pool.acquire(), 'a')
+
+    def test_throttled_loop(self):
+        # a loop faster than the keys' combined rate waits rather than fails
+        pool = KeyPool(['a', 'b'], rate=5)
+        start = time.time()
+        used = [pool.acquire() for i in range(15)]
+        elapsed = time.time() - start
+
+        self.assertEqual(sorted(used), ['a'] * 8 + ['b'] * 7)
+        self.assertTrue(1 <= elapsed < 2.5)
+
+        # daily budgets still run out
+        pool = KeyPool(['a'], rate=5, daily_budget=2)
+        pool.acquire()
+        pool.acquire()
+        with self.assertRaises(QuotaExceeded):
+            pool.acquire()
+
+    def test_sideline(self):
+        pool = KeyPool(['a', 'b'])
+        pool.sideline('a')
+        self.assertEqual([pool.acquire() for i in range(3)], ['b', 'b', 'b'])
+
+        pool.reinstate('a')
+        self.assertEqual(pool.available_count(), 2)
+
+    def test_sideline_expiry(self):
+        pool = KeyPool(['a', 'b'], daily_budget=3)
+        with patch('time.time', Mock(return_value=1000.2)):
+            pool.acquire()
+            pool.acquire()
+            pool.sideline('a', permanent=False)
+            pool.sideline('b')
+            self.assertEqual(pool.available_count(), 0)
+
+        # over quota: back once the rate window rolls over
+        with patch('time.time', Mock(return_value=1001.3)):
+            self.assertEqual(pool.available_count(), 1)
+            self.assertEqual(pool.acquire(), 'a')
+            self.assertEqual(pool.acquire(), 'a')
+
+            # ...or, with the daily budget spent, once the UTC day does
+            pool.sideline('a', permanent=False)
+            self.assertEqual(pool.keys[0].sidelined_until, 86400.0)
+
+        with patch('time.time', Mock(return_value=86400.5)):
+            self.assertEqual(pool.acquire(), 'a')
+
+            # refused keys stay out
+            self.assertTrue(pool.keys[1].sidelined)
+
+    @patch('requests.get')
+    def test_client_sidelines_rejected_key(self, get):
+        rejected = Mock()
+        rejected.status_code = 403
+        accepted = Mock()
+        accepted.status_code = 200
+        accepted.json.return_value = self.success_response_dict
+
+        def respond(url, params, headers=None):
+            return rejected if params['api-key'] == 'bad' else accepted
+        get.side_effect = respond
+
+        client = DistrictApi(['bad', 'good'])
+        for i in range(3):
+            self.assertEqual(client.get_data((40.7, -74.0)),
+                self.success_response_dict)
+
+        self.assertTrue(client.key_pool.keys[0].sidelined)
+        self.assertEqual(client.key_pool.keys[1].day_count, 3)
+
+        # A 429 only sidelines a key until its quota frees up
+        rejected.status_code = 429
+        client = DistrictApi(['bad', 'good'])
+        client.get_data((40.7, -74.0))
+        self.assertTrue(client.key_pool.keys[0].sidelined)
+        self.assertTrue(client.key_pool.keys[0].sidelined_until <
+            time.time() + 1.5)
+
+        # Once every key has been rejected, the error reaches the caller
+        client.key_pool.sideline('good')
+        with self.assertRaises(QuotaExceeded):
+            client.get_data((40.7, -74.0))
+
+    @patch('requests.get')
+    def test_single_key_not_sidelined(self, get):
+        mock_resp = Mock()
+        mock_resp.status_code = 403
+        get.return_value = mock_resp
+
+        client = DistrictApi('only')
+        with self.assertRaises(AuthorizationError):
+            client.get_data()
+
+        self.assertEqual(client.key_pool.available_count(), 1)
@@ -0,0 +1,97 @@
+import random
+from unittest import TestCase
+
+from district_api.geometry import point_segment_distance
+from district_api.nearest import SegmentTree, BoundaryIndex, \
+    boundary_confidence, METERS_PER_DEGREE_LAT
+
+from district_api.api import District
+
+from test_spatial import square
+from test_shared import boundaries, council_1, council_2, senate_24
+
+class NearestTestCase(TestCase):
+
+    def test_segment_tree(self):
+        random.seed(2)
+        segments = []
+        for i in range(500):
+            x = random.uniform(0, 100)
+            y = random.uniform(0, 100)
+            segments.append((x, y, x + random.uniform(-2, 2),
+                y + random.uniform(-2, 2), i))
+
+        tree = SegmentTree(segments, node_capacity=4)
+        self.assertEqual(len(tree), 500)
+
+        for i in range(200):
+            x = random.uniform(-10, 110)
+            y = random.uniform(-10, 110)
+            distance, owner = tree.nearest(x, y)
+
+            brute = min(point_segment_distance(x, y, *s[:4])
+                for s in segments)
+            self.assertAlmostEqual(distance, brute)
+            self.assertAlmostEqual(point_segment_distance(x, y,
+                *segments[owner][:4]), brute)
+
+        self.assertEqual(SegmentTree([]).nearest(0, 0), None)
+
+    def test_distance_to_boundary(self):
+        index = BoundaryIndex(boundaries)
+
+        # 1 degree of latitude north of council district 1's southern edge
+        distance, district = index.distance_to_boundary((1, 5),
+            'City Council')
+        self.assertEqual(district, council_1)
+        self.assertAlmostEqual(distance, METERS_PER_DEGREE_LAT, places=3)
+
+        distance, district = index.distance_to_boundary((5, 19.5))
+        self.assertTrue(district in (council_2, senate_24))
+        self.assertTrue(distance < METERS_PER_DEGREE_LAT)
+
+    def test_nearest_district(self):
+        index = BoundaryIndex(boundaries)
+
+        self.assertEqual(index.nearest_district((5, 5), 'City Council'),
+            (council_1, 0.0))
+
+        # just outside coverage, to the south of council district 2
+        district, distance = index.nearest_district((-0.5, 12),
+            'City Council')
+        self.assertEqual(district, council_2)
+        self.assertAlmostEqual(distance, METERS_PER_DEGREE_LAT / 2, places=3)
+
+        nearest = index.nearest_districts((25, 25))
+        self.assertEqual(sorted(nearest), ['City Council', 'State Senate'])
+        self.assertEqual(nearest['City Council'][0], council_2)
+
+    def test_nearest_district_candidates(self):
+        # a 20x20 patchwork of districts
+        tiles = [(District(str(i), 'Tile', None), square(i % 20, i // 20, 1))
+            for i in range(400)]
+        index = BoundaryIndex({'Tile': tiles})
+
+        tested = []
+        for district, boundary in tiles:
+            boundary.contains = (lambda contains, name: lambda x, y:
+                tested.append(name) or contains(x, y))(boundary.contains,
+                district.district)
+
+        # (lat, lng) inside tile 7 + 20 * 13
+        self.assertEqual(index.nearest_district((13.5, 7.5), 'Tile'),
+            (tiles[267][0], 0.0))
+        self.assertTrue(len(tested) <= 4)
+
+        district, distance = index.nearest_district((-1, 7.5), 'Tile')
+        self.assertEqual(district, tiles[7][0])
+
+    def test_confidence(self):
+        self.assertEqual(boundary_confidence(0), 0)
+        self.assertTrue(0.6 < boundary_confidence(50) < 0.7)
+        self.assertTrue(boundary_confidence(1000) > 0.99)
+
+        index = BoundaryIndex(boundaries)
+        scores = index.confidence((5, 5))
+        self.assertTrue(scores['State Senate'] > 0.99)
+        self.assertEqual(index.confidence((0, 5))['City Council'], 0)
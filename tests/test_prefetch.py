@@ -0,0 +1,195 @@
+import time
+import threading
+from collections import Counter
+from io import BytesIO
+from unittest import TestCase
+from mock import Mock
+from requests.exceptions import ConnectionError
+
+from district_api.exceptions import LocationUnavailable, ApiUnavailable
+from district_api.prefetch import quantize, RateBudget, ResultCache, \
+    PrefetchingClient
+
+def lookup(lat_lng):
+    lat, lng = lat_lng
+    if lat < 0:
+        raise LocationUnavailable()
+    return {'City Council': 'north' if lat >= 0.5 else 'south'}
+
+class PrefetchTestCase(TestCase):
+
+    def client(self, side_effect=lookup):
+        client = Mock(spec=['get_districts'])
+        client.get_districts.side_effect = side_effect
+        return client
+
+    def test_quantize(self):
+        self.assertEqual(quantize((40.7128, -74.006), 0.001), (40713, -74006))
+        self.assertEqual(quantize(('1.04', '2.06'), 0.1), (10, 21))
+
+    def test_rate_budget(self):
+        budget = RateBudget(100, burst=2)
+        self.assertTrue(budget.try_acquire())
+        self.assertTrue(budget.try_acquire())
+        self.assertFalse(budget.try_acquire())
+
+        start = time.time()
+        budget.acquire()
+        self.assertGreater(time.time() - start, 0.005)
+
+        with self.assertRaises(ValueError):
+            RateBudget(0)
+
+    def test_result_cache(self):
+        cache = ResultCache(maxsize=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+
+        # b was least recently used
+        self.assertEqual(len(cache), 2)
+        self.assertNotIn('b', cache)
+        self.assertEqual(cache.get('b', 'missing'), 'missing')
+        self.assertEqual(cache.get('a'), 1)
+
+    def test_prefetch(self):
+        client = self.client()
+        prefetcher = PrefetchingClient(client, step=0.5, rate=1000)
+
+        self.assertEqual(prefetcher.get_districts((0.1, 0.1)),
+            {'City Council': 'south'})
+        prefetcher.wait()
+
+        # one lookup, plus the 8 cells around it
+        self.assertEqual(client.get_districts.call_count, 9)
+        self.assertEqual(len(prefetcher.cache), 9)
+        self.assertEqual(prefetcher.stats['prefetched'], 8)
+
+        # walking into a neighbouring cell is answered from the cache
+        self.assertEqual(prefetcher.get_districts((0.2, 0.6)),
+            {'City Council': 'south'})
+        self.assertEqual(prefetcher.get_districts((0.6, 0.0)),
+            {'City Council': 'north'})
+        with self.assertRaises(LocationUnavailable):
+            prefetcher.get_districts((-0.5, 0.0))
+
+        self.assertEqual(client.get_districts.call_count, 9)
+        self.assertEqual(prefetcher.stats['hits'], 3)
+        self.assertEqual(prefetcher.stats['misses'], 1)
+
+        prefetcher.close()
+
+    def test_no_double_fetch(self):
+        entered = threading.Event()
+        release = threading.Event()
+
+        def slow_lookup(lat_lng):
+            if lat_lng == (0.0, 0.5):
+                entered.set()
+                release.wait(5)
+            return lookup(lat_lng)
+
+        client = self.client(slow_lookup)
+        prefetcher = PrefetchingClient(client, step=0.5, rate=1000)
+        prefetcher.get_districts((0.1, 0.1))
+        self.assertTrue(entered.wait(5))
+
+        # queued but not yet started: fetched on demand, and dropped from
+        # the queue
+        self.assertEqual(prefetcher.get_districts((0.6, 0.6)),
+            {'City Council': 'north'})
+
+        # being fetched in the background: waits for that fetch
+        waiting = threading.Thread(target=prefetcher.get_districts,
+            args=((0.1, 0.6),))
+        waiting.start()
+        time.sleep(0.05)
+        release.set()
+        waiting.join(5)
+        prefetcher.wait()
+
+        cells = Counter(quantize(call[0][0], 0.5) for call in
+            client.get_districts.call_args_list)
+        # each cell was fetched exactly once
+        self.assertEqual(set(cells.values()), set([1]))
+        self.assertIn((1, 1), cells)
+        self.assertEqual(prefetcher.stats['misses'], 3)
+
+        prefetcher.close()
+
+    def test_prefetch_limits(self):
+        client = self.client()
+        prefetcher = PrefetchingClient(client, step=0.5, rate=1000,
+            max_pending=0)
+        prefetcher.get_districts((0.1, 0.1))
+        prefetcher.wait()
+
+        self.assertEqual(client.get_districts.call_count, 1)
+        self.assertEqual(prefetcher.stats['dropped'], 8)
+
+        # errors in the background are swallowed
+        client = self.client(ApiUnavailable())
+        prefetcher = PrefetchingClient(client, step=0.5, rate=1000)
+        prefetcher.warm_up(['0.1,0.1'])
+        prefetcher.wait()
+
+        self.assertEqual(len(prefetcher.cache), 0)
+        with self.assertRaises(ApiUnavailable):
+            prefetcher.get_districts((0.1, 0.1))
+
+        prefetcher.close()
+
+    def test_network_errors(self):
+        failures = []
+
+        def flaky_lookup(lat_lng):
+            if not failures:
+                failures.append(lat_lng)
+                raise ConnectionError('connection reset')
+            return lookup(lat_lng)
+
+        # errors from requests aren't DistrictApiErrors, but mustn't kill
+        # the background thread either
+        client = self.client(flaky_lookup)
+        prefetcher = PrefetchingClient(client, step=0.5, rate=1000)
+        prefetcher.warm_up(['0.1,0.1', '2.1,2.1', '2.1,2.1'])
+        prefetcher.wait()
+
+        self.assertEqual(len(failures), 1)
+        self.assertTrue(prefetcher._worker.is_alive())
+        self.assertEqual(len(prefetcher.cache), 1)
+        self.assertEqual(prefetcher._queued, set())
+
+        # the failed cell is fetched on demand, and prefetching carries on
+        prefetcher.get_districts((2.1, 2.1))
+        prefetcher.wait()
+        self.assertEqual(prefetcher.stats['prefetched'], 9)
+
+        prefetcher.close()
+
+    def test_access_log_warm_up(self):
+        log = BytesIO()
+        prefetcher = PrefetchingClient(self.client(), step=0.5, radius=0,
+            access_log=log)
+        for lat_lng in [(0.1, 0.1), (2.1, 2.1), (2.0, 2.0), (5.0, 5.0),
+            (2.2, 1.9), (0.2, 0.0)]:
+            prefetcher.get_districts(lat_lng)
+
+        lines = log.getvalue().splitlines()
+        self.assertEqual(len(lines), 6)
+        self.assertEqual(lines[1], '2.0,2.0')
+
+        # a new node replays the two hottest cells
+        client = self.client()
+        warmed = PrefetchingClient(client, step=0.5, rate=1000)
+        self.assertEqual(warmed.warm_up(lines + ['garbage'], limit=2), 2)
+        warmed.wait()
+
+        self.assertEqual(sorted(call[0][0] for call in
+            client.get_districts.call_args_list), [(0.0, 0.0), (2.0, 2.0)])
+
+        warmed.get_districts((2.1, 1.9))
+        self.assertEqual(warmed.stats['hits'], 1)
+
+        warmed.close()
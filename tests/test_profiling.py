@@ -0,0 +1,134 @@
+import time
+from io import BytesIO
+from unittest import TestCase
+from mock import patch, Mock
+
+from district_api.api import DistrictApi
+from district_api.exceptions import ApiUnavailable
+from district_api.profiling import Profiler, NULL_PROFILER
+
+class ProfilerTestCase(TestCase):
+
+    def test_spans(self):
+        profiler = Profiler(slowest=2, recent=3)
+
+        for delay in (0.01, 0.03, 0.0, 0.02):
+            with profiler.span('call'):
+                with profiler.span('inner'):
+                    time.sleep(delay)
+                profiler.annotate({'api-key': 'secret', 'lat': delay})
+
+        traces = profiler.traces()
+        self.assertEqual(len(traces), 3)
+        self.assertEqual(traces[-1].query_vars, {'api-key': '<redacted>',
+            'lat': 0.02})
+        self.assertEqual([span[0] for span in traces[-1].spans],
+            [('call', 'inner'), ('call',)])
+        self.assertTrue(traces[-1].duration >= traces[-1].spans[0][2] >= 0.02)
+
+        slowest = profiler.slowest()
+        self.assertEqual([trace.query_vars['lat'] for trace in slowest],
+            [0.03, 0.02])
+
+        # time in nested spans isn't counted against the outer span
+        totals = profiler.totals()
+        self.assertTrue(totals[('call', 'inner')] >= 0.06)
+        self.assertTrue(totals[('call',)] < 0.01)
+
+        out = BytesIO()
+        profiler.dump(out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual([line.split(' ')[0] for line in lines],
+            ['call', 'call;inner'])
+        self.assertTrue(int(lines[1].split(' ')[1]) >= 60000)
+
+        profiler.reset()
+        self.assertEqual(profiler.traces(), [])
+        self.assertEqual(profiler.totals(), {})
+
+    def test_sampling(self):
+        profiler = Profiler(sample=0.5)
+        with patch('random.random', return_value=0.7):
+            with profiler.span('call'):
+                with profiler.span('inner'):
+                    profiler.annotate({'lat': 1})
+
+        self.assertEqual(profiler.traces(), [])
+        self.assertEqual(profiler.totals(), {})
+
+        with patch('random.random', return_value=0.2):
+            with profiler.span('call'):
+                pass
+
+        self.assertEqual(len(profiler.traces()), 1)
+
+        with self.assertRaises(ValueError):
+            Profiler(sample=0)
+
+    @patch('requests.get')
+    def test_client_profiling(self, get):
+        mock_resp = Mock()
+        mock_resp.status_code = 200
+        mock_resp.json.return_value = {
+            "results": [{
+                "district": "31",
+                "level": "State Senate",
+                "kml_url": None,
+            }],
+            "status": "OK",
+        }
+        get.return_value = mock_resp
+
+        client = DistrictApi('dummy')
+        self.assertIs(client.profiler, NULL_PROFILER)
+        client.get_districts((1, 2))
+
+        profiler = client.enable_profiling(slowest=5)
+        client.get_districts((1, 2))
+        client.get_all_districts()
+
+        traces = profiler.traces()
+        self.assertEqual([trace.name for trace in traces],
+            ['get_districts', 'get_all_districts'])
+        self.assertEqual(traces[0].query_vars, {'api-key': '<redacted>',
+            'lat': 1.0, 'lng': 2.0})
+        self.assertEqual(set(profiler.totals()), set([
+            ('get_districts',),
+            ('get_districts', 'get_data'),
+            ('get_districts', 'get_data', 'send_request'),
+            ('get_districts', 'get_data', 'validate_response'),
+            ('get_districts', 'get_data', 'parse_response'),
+            ('get_districts', 'get_data', 'validate_response_body'),
+            ('get_districts', 'construct_single_location_data'),
+            ('get_all_districts',),
+            ('get_all_districts', 'get_data'),
+            ('get_all_districts', 'get_data', 'send_request'),
+            ('get_all_districts', 'get_data', 'validate_response'),
+            ('get_all_districts', 'get_data', 'parse_response'),
+            ('get_all_districts', 'get_data', 'validate_response_body'),
+            ('get_all_districts', 'construct_all_locations_data'),
+            ('get_all_districts', 'construct_all_locations_data', 'sort'),
+        ]))
+
+        # one catalog call is one trace, building the catalog included
+        profiler.reset()
+        client.get_district_catalog()
+        traces = profiler.traces()
+        self.assertEqual([trace.name for trace in traces],
+            ['get_district_catalog'])
+        self.assertEqual([span[0] for span in traces[0].spans][-3:], [
+            ('get_district_catalog', 'construct_all_locations_data'),
+            ('get_district_catalog', 'construct_catalog'),
+            ('get_district_catalog',)])
+
+        # failed calls are traced too
+        mock_resp.status_code = 500
+        with self.assertRaises(ApiUnavailable):
+            client.get_districts((1, 2))
+        self.assertEqual(len(profiler.traces()), 2)
+        self.assertEqual(profiler.traces()[-1].spans[-1][0],
+            ('get_districts',))
+
+        self.assertIs(client.disable_profiling(), profiler)
+        self.assertIs(client.profiler, NULL_PROFILER)
+        self.assertEqual(client.disable_profiling(), None)
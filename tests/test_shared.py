@@ -0,0 +1,119 @@
+import os
+import shutil
+import struct
+import tempfile
+import multiprocessing
+from unittest import TestCase
+from mock import patch
+
+from district_api.api import District
+from district_api.geometry import Polygon, MultiPolygon
+from district_api.shared import SharedIndex
+
+from test_spatial import square
+
+council_1 = District('1', 'City Council', 'http://example.com/1.xml')
+council_2 = District('2', 'City Council', 'http://example.com/2.xml')
+senate_24 = District('24', 'State Senate', 'http://example.com/24.xml')
+
+boundaries = {
+    'City Council': [
+        (council_1, square(0, 0, 10)),
+        (council_2, MultiPolygon([
+            Polygon([[10, 0, 20, 0, 20, 10, 10, 10],
+                [14, 4, 16, 4, 16, 6, 14, 6]]),
+            Polygon([[30, 30, 31, 30, 31, 31, 30, 31]]),
+        ])),
+    ],
+    'State Senate': [
+        (senate_24, square(0, 0, 20)),
+    ],
+}
+
+# Built before the pool forks, as a prefork server would
+forked_index = SharedIndex.build(boundaries, cell_size=3)
+
+def _locate_in_worker(lat_lng):
+    return dict((level, district.district) for level, district in
+        forked_index.locate(lat_lng).items())
+
+class SharedIndexTestCase(TestCase):
+
+    def check_index(self, index):
+        self.assertEqual(index.locate((5, 5)), {
+            'City Council': council_1,
+            'State Senate': senate_24,
+        })
+        self.assertEqual(index.locate((5, 12)), {
+            'City Council': council_2,
+            'State Senate': senate_24,
+        })
+        # in the hole
+        self.assertEqual(index.locate((5, 15)), {'State Senate': senate_24})
+        self.assertEqual(index.locate((30.5, 30.5)), {
+            'City Council': council_2})
+        self.assertEqual(index.locate((15, 25)), {})
+        self.assertEqual(index.locate((-50, 100)), {})
+
+    def test_anonymous(self):
+        for cell_size in (None, 0.5, 100):
+            self.check_index(SharedIndex.build(boundaries,
+                cell_size=cell_size))
+
+        self.assertEqual(len(SharedIndex.build(boundaries).districts()), 3)
+
+    def test_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'districts.idx')
+            index = SharedIndex.build(boundaries, path=path)
+            self.assertEqual(index.path, path)
+            self.check_index(index)
+
+            attached = SharedIndex.attach(path)
+            self.check_index(attached)
+            attached.close()
+            index.close()
+
+            with open(path, 'wb') as f:
+                f.write(b'nonsense' * 20)
+            with self.assertRaises(ValueError):
+                SharedIndex.attach(path)
+
+        finally:
+            shutil.rmtree(directory)
+
+    def test_holes_skipped(self):
+        index = SharedIndex.build(boundaries, cell_size=100)
+        unpacked = []
+        unpack_from = struct.unpack_from
+        def counting_unpack_from(fmt, *args, **kwargs):
+            unpacked.append(fmt)
+            return unpack_from(fmt, *args, **kwargs)
+
+        # only the rings whose bounding boxes hold the point are unpacked:
+        # both outer rings, but not the hole
+        with patch('struct.unpack_from', counting_unpack_from):
+            self.assertEqual(index.locate((2, 12)), {
+                'City Council': council_2,
+                'State Senate': senate_24,
+            })
+        self.assertEqual(len(unpacked), 2)
+
+    def test_empty(self):
+        index = SharedIndex.build({})
+        self.assertEqual(index.locate((5, 5)), {})
+
+    def test_forked_workers(self):
+        pool = multiprocessing.Pool(2)
+        try:
+            results = pool.map(_locate_in_worker, [(5, 5), (5, 12), (15, 25)])
+        finally:
+            pool.close()
+            pool.join()
+
+        self.assertEqual(results, [
+            {'City Council': '1', 'State Senate': '24'},
+            {'City Council': '2', 'State Senate': '24'},
+            {},
+        ])
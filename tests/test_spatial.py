@@ -0,0 +1,143 @@
+from io import BytesIO
+from unittest import TestCase
+from mock import patch, Mock
+
+from district_api.api import DistrictApi, District
+from district_api.geometry import Polygon, MultiPolygon
+from district_api.spatial import GridIndex, PointGrid, spatial_join
+
+from test_geometry import KML
+
+def square(x, y, size):
+    return MultiPolygon([Polygon([[x, y, x + size, y, x + size, y + size,
+        x, y + size]])])
+
+council_1 = District('1', 'City Council', 'http://example.com/1.xml')
+council_2 = District('2', 'City Council', 'http://example.com/2.xml')
+senate_24 = District('24', 'State Senate', 'http://example.com/24.xml')
+
+class SpatialTestCase(TestCase):
+    boundaries = {
+        'City Council': [
+            (council_1, square(0, 0, 10)),
+            (council_2, square(10, 0, 10)),
+        ],
+        'State Senate': [
+            (senate_24, square(0, 0, 20)),
+        ],
+    }
+    # (lat, lng) pairs
+    points = [(5, 5), (5, 15), (1, 1), (15, 15), (50, 50), (9, 19)]
+
+    def test_grid(self):
+        grid = GridIndex(10)
+        self.assertEqual(grid.cell_of(5, -5), (0, -1))
+        self.assertEqual(sorted(grid.cells_for_bbox((5, 5, 15, 25))),
+            [(0, 0), (0, 1), (0, 2), (1, 0), (1, 1), (1, 2)])
+
+        with self.assertRaises(ValueError):
+            GridIndex(0)
+
+    def test_point_grid(self):
+        points = PointGrid(self.points, GridIndex(10))
+        self.assertEqual(len(points), 6)
+        self.assertEqual(sorted(points.candidates((0, 0, 9, 9))), [0, 2])
+        self.assertEqual(list(points.within(square(0, 0, 10))), [0, 2])
+        self.assertEqual(points.count_within(square(0, 0, 10)), 2)
+
+    def test_counts(self):
+        for cell_size in (None, 1, 100):
+            results = spatial_join(self.points, self.boundaries,
+                cell_size=cell_size)
+            self.assertEqual(results, {
+                'City Council': {council_1: 2, council_2: 2, },
+                'State Senate': {senate_24: 5, },
+            })
+
+    def test_groups(self):
+        results = spatial_join(self.points, self.boundaries,
+            levels=['City Council'], groups=True)
+        self.assertEqual(results.keys(), ['City Council'])
+        self.assertEqual(list(results['City Council'][council_1]), [0, 2])
+        self.assertEqual(list(results['City Council'][council_2]), [1, 5])
+
+    def test_empty(self):
+        results = spatial_join([], self.boundaries)
+        self.assertEqual(results['State Senate'], {senate_24: 0})
+
+    def test_same_name(self):
+        # districts at one level that share a name are kept apart
+        east = District('1', 'Neighborhood', 'http://example.com/east.xml')
+        west = District('1', 'Neighborhood', 'http://example.com/west.xml')
+        results = spatial_join(self.points, {'Neighborhood': [
+            (east, square(10, 0, 10)), (west, square(0, 0, 10))]})
+        self.assertEqual(results['Neighborhood'], {east: 2, west: 2})
+
+    def test_clustered_points(self):
+        # points spread over far less than the boundaries
+        for points in ([(5, 5)], [(5, 5)] * 3, [(5, 5), (5.001, 5.001)]):
+            results = spatial_join(points, self.boundaries)
+            self.assertEqual(results['State Senate'],
+                {senate_24: len(points)})
+            self.assertEqual(results['City Council'],
+                {council_1: len(points), council_2: 0})
+
+        grid = PointGrid(iter([(5, 5), (5, 5)]))
+        self.assertEqual(len(grid), 2)
+        self.assertEqual(len(grid.cells), 1)
+        self.assertEqual(list(grid.within(square(-100, -100, 200))), [0, 1])
+
+    def test_sparse_grid(self):
+        # a cell size far smaller than the spread of the points
+        points = PointGrid(self.points, GridIndex(0.001))
+        self.assertEqual(len(points.cells), 6)
+        self.assertEqual(list(points.within(square(0, 0, 10))), [0, 2])
+        self.assertEqual(sorted(points.order), range(6))
+
+    def test_processes(self):
+        self.assertEqual(spatial_join(self.points, self.boundaries,
+            processes=2), spatial_join(self.points, self.boundaries))
+        self.assertEqual(spatial_join(self.points, self.boundaries,
+            groups=True, processes=2), spatial_join(self.points,
+            self.boundaries, groups=True))
+
+    @patch('requests.get')
+    def test_client_spatial_join(self, get):
+        all_resp = Mock()
+        all_resp.status_code = 200
+        all_resp.json.return_value = {
+            "results": [
+                {
+                    "district": "24",
+                    "level": "State Senate",
+                    "kml_url": "http://example.com/24.xml",
+                },
+                {
+                    "district": "Westerleigh",
+                    "level": "Neighborhood",
+                    "kml_url": None,
+                },
+            ],
+            "status": "OK",
+        }
+        kml_resp = Mock()
+        kml_resp.status_code = 200
+
+        def respond(url, **kwargs):
+            if not url.endswith('.xml'):
+                return all_resp
+            self.assertTrue(kwargs['stream'])
+            kml_resp.raw = BytesIO(KML)
+            return kml_resp
+        get.side_effect = respond
+
+        client = DistrictApi('dummy')
+        boundaries = client.get_boundaries()
+        self.assertEqual(boundaries['Neighborhood'], [])
+        self.assertEqual(boundaries['State Senate'][0][0].district, '24')
+
+        results = client.spatial_join([(1, 1), (5, 5), (21, 25)])
+        self.assertEqual(results, {
+            'Neighborhood': {},
+            'State Senate': {boundaries['State Senate'][0][0]: 2},
+        })